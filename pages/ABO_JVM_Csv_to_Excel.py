@@ -277,6 +277,161 @@ def calculate_remaining_magazines(df):
     
     return df
 
+def normalize_ids(id_series):
+    """Normalise des identifiants Shopify (numériques, texte ou gid://) pour la jointure"""
+    ids = id_series.astype(str).str.strip()
+    ids = ids.str.replace(r'\.0$', '', regex=True)
+    # "gid://shopify/SubscriptionContract/123" -> "123"
+    return ids.str.rsplit('/', n=1).str[-1]
+
+def detect_order_columns(order_columns):
+    """Détecte les colonnes utiles d'un export de commandes Shopify"""
+    columns = {}
+    lowered = [str(col).strip().lower() for col in order_columns]
+
+    candidates = {
+        # Clé de jointure avec les abonnements
+        'key': ['subscription id', 'subscription_id', 'subscription contract id',
+                'customer: id', 'customer id', 'customer_id'],
+        # Montant total de la commande
+        'total': ['total', 'price: total', 'total price', 'total_price'],
+        # Montants remboursés (optionnel)
+        'refunded': ['refunded amount', 'refund: total', 'total refunded', 'refunded_amount'],
+        # Reste à payer pour les paiements partiels (optionnel)
+        'outstanding': ['outstanding balance', 'price: outstanding balance', 'outstanding_balance'],
+        # Statut de paiement (optionnel)
+        'status': ['financial status', 'payment: status', 'financial_status'],
+        # Date de la commande (optionnel, sert à ne garder que le cycle en cours)
+        'date': ['created at', 'created_at', 'processed at', 'processed_at']
+    }
+
+    for field, aliases in candidates.items():
+        for alias in aliases:
+            if alias in lowered:
+                columns[field] = order_columns[lowered.index(alias)]
+                break
+
+    return columns
+
+# Marge avant le début du cycle : la commande de renouvellement peut être passée un peu avant l'échéance
+CYCLE_START_TOLERANCE = pd.Timedelta(days=7)
+
+def current_cycle_starts(debt_df, id_column='ID'):
+    """Début du cycle de 12 mois en cours de chaque abonné (même règle que calculate_sent_magazines)"""
+    missing = pd.Series(pd.NaT, index=debt_df.index, dtype='datetime64[ns]')
+    next_order = pd.to_datetime(debt_df['Next order date'], errors='coerce') if 'Next order date' in debt_df.columns else missing
+    created = pd.to_datetime(debt_df['Created at'], errors='coerce') if 'Created at' in debt_df.columns else missing
+    starts = (next_order - pd.DateOffset(months=12)).fillna(created)
+    # Plusieurs abonnements pour un même identifiant : le cycle commencé le plus tôt
+    return pd.Series(starts.to_numpy(), index=normalize_ids(debt_df[id_column]).to_numpy()).groupby(level=0).min()
+
+def aggregate_order_payments(order_files, subscription_ids, chunksize=100_000, cycle_starts=None):
+    """Agrège par abonné les montants réellement payés, en lisant les exports de commandes par blocs.
+    Avec cycle_starts (début du cycle par abonné), seules les commandes du cycle en cours sont comptées."""
+
+    # Table de hachage côté abonnements (petite), sondée par chaque bloc de commandes
+    id_index = pd.Index(subscription_ids).unique()
+    paid_totals = pd.Series(0.0, index=id_index)
+    order_counts = pd.Series(0, index=id_index)
+
+    # Statuts pour lesquels un paiement a réellement été encaissé
+    paid_statuses = ['paid', 'partially_paid', 'partially_refunded', 'refunded']
+
+    for order_file in order_files:
+        # Totaux propres au fichier : un fichier illisible en cours de route est écarté en entier
+        file_totals = pd.Series(0.0, index=id_index)
+        file_counts = pd.Series(0, index=id_index)
+        try:
+            header = pd.read_csv(order_file, nrows=0).columns.tolist()
+            columns = detect_order_columns(header)
+
+            if 'key' not in columns or 'total' not in columns:
+                st.error(f"❌ {order_file.name} : colonnes d'identifiant ou de total introuvables.")
+                continue
+
+            if cycle_starts is not None and 'date' not in columns:
+                st.warning(f"⚠️ {order_file.name} : pas de date de commande, toutes les commandes sont comptées (tous cycles confondus).")
+
+            order_file.seek(0)
+            reader = pd.read_csv(
+                order_file,
+                usecols=list(columns.values()),
+                dtype={columns['key']: str},
+                chunksize=chunksize
+            )
+
+            for chunk in reader:
+                keys = normalize_ids(chunk[columns['key']])
+                # Jointure par hachage : ne garder que les commandes des abonnés connus
+                matched = keys.isin(id_index) & chunk[columns['key']].notna()
+                if 'status' in columns:
+                    # Les lignes suivantes d'une commande n'ont pas de statut : seule la première porte le total
+                    # (un bloc sans aucun statut est lu comme numérique, d'où la conversion en texte)
+                    status = chunk[columns['status']].astype('string').str.lower()
+                    matched &= status.isin(paid_statuses) | status.isna()
+                if cycle_starts is not None and 'date' in columns:
+                    # Commandes des cycles précédents écartées (dates sans fuseau, comme les abonnements)
+                    dates = robust_date_conversion(chunk[columns['date']])
+                    starts = keys.map(cycle_starts)
+                    matched &= dates.isna() | starts.isna() | (dates >= starts - CYCLE_START_TOLERANCE)
+                if not matched.any():
+                    continue
+
+                chunk = chunk[matched]
+                paid = pd.to_numeric(chunk[columns['total']], errors='coerce')
+                for field in ['refunded', 'outstanding']:
+                    if field in columns:
+                        paid = paid - pd.to_numeric(chunk[columns[field]], errors='coerce').fillna(0)
+
+                grouped = paid.groupby(keys[matched]).agg(['sum', 'count'])
+                file_totals = file_totals.add(grouped['sum'], fill_value=0)
+                file_counts = file_counts.add(grouped['count'], fill_value=0)
+        except Exception as e:
+            st.error(f"❌ Erreur lors de la lecture de {order_file.name} : fichier ignoré dans le rapprochement ({e})")
+            continue
+
+        paid_totals = paid_totals.add(file_totals, fill_value=0)
+        order_counts = order_counts.add(file_counts, fill_value=0)
+        st.write(f"✅ Export de commandes {order_file.name} rapproché")
+
+    return pd.DataFrame({'Payé (€)': paid_totals, 'Commandes': order_counts.astype(int)})
+
+def reconcile_debt(debt_df, payments, id_column='ID'):
+    """Compare pour chaque abonné le montant payé à la valeur des magazines livrés"""
+
+    subscribers = debt_df.assign(
+        _key=normalize_ids(debt_df[id_column]),
+        _livre=debt_df['Magazines envoyés'] * debt_df['Prix par magazine'],
+        _estime=debt_df['Magazines Restants'] * debt_df['Prix par magazine']
+    )
+
+    reconciliation = subscribers.groupby('_key', sort=False).agg(**{
+        'Nom Prénom': ('Customer name', 'first'),
+        'Zone': ('Zone', 'first'),
+        'Magazines envoyés': ('Magazines envoyés', 'sum'),
+        'Magazines Restants': ('Magazines Restants', 'sum'),
+        'Valeur livrée (€)': ('_livre', 'sum'),
+        'Dette estimée (€)': ('_estime', 'sum')
+    })
+
+    reconciliation = reconciliation.join(payments, how='left')
+    reconciliation['Commandes'] = reconciliation['Commandes'].fillna(0).astype(int)
+    reconciliation['Payé (€)'] = reconciliation['Payé (€)'].fillna(0.0)
+
+    # Dette réelle = ce qui a été payé moins ce qui a déjà été livré
+    reconciliation['Dette réelle (€)'] = reconciliation['Payé (€)'] - reconciliation['Valeur livrée (€)']
+    reconciliation['Écart (€)'] = reconciliation['Dette réelle (€)'] - reconciliation['Dette estimée (€)']
+
+    reconciliation['Statut'] = 'OK'
+    reconciliation.loc[reconciliation['Écart (€)'].abs() >= 0.01, 'Statut'] = 'Écart'
+    reconciliation.loc[reconciliation['Commandes'] == 0, 'Statut'] = 'Aucune commande trouvée'
+
+    amount_columns = ['Valeur livrée (€)', 'Dette estimée (€)', 'Payé (€)', 'Dette réelle (€)', 'Écart (€)']
+    reconciliation[amount_columns] = reconciliation[amount_columns].round(2)
+
+    reconciliation.index.name = 'ID'
+    return reconciliation.reset_index()
+
 def process_csv(uploaded_files, include_youtube=False):
     """Lit et traite plusieurs fichiers CSV, avec option d'inclure les abonnés YouTube."""
     all_dataframes = []
@@ -448,6 +603,9 @@ include_youtube = st.checkbox("Inclure les abonnés YouTube depuis MongoDB", val
 file_prefix = st.text_input("Entrez le préfixe pour les fichiers finaux :", "")
 uploaded_files = st.file_uploader("Téléversez les fichiers CSV des abonnements", type="csv", accept_multiple_files=True)
 
+# Rapprochement des paiements (renseigné seulement si des exports de commandes sont fournis)
+reconciliation = None
+
 if uploaded_files:
     with st.spinner("Traitement des données en cours..."):
         active_df, cancelled_df = process_csv(uploaded_files, include_youtube)
@@ -744,6 +902,38 @@ if uploaded_files:
                         st.metric("Dette moyenne", f"{debt_report['Dette Totale (€)'].mean():.2f} €")
                     with col3:
                         st.metric("Total magazines", int(debt_report['Magazines Restants'].sum()))
+                    
+                    # Rapprochement optionnel avec les paiements réels
+                    st.write("### 🧾 Rapprochement avec les paiements Shopify (optionnel)")
+                    order_files = st.file_uploader(
+                        "Téléversez les exports de commandes Shopify (CSV)",
+                        type="csv",
+                        accept_multiple_files=True,
+                        key="order_exports",
+                        help="La dette réelle est calculée à partir des montants payés sur le cycle de 12 mois en cours (remises, remboursements et paiements partiels inclus)"
+                    )
+                    
+                    if order_files and 'ID' in debt_df.columns:
+                        with st.spinner("Rapprochement des paiements en cours..."):
+                            payments = aggregate_order_payments(
+                                order_files, normalize_ids(debt_df['ID']), cycle_starts=current_cycle_starts(debt_df)
+                            )
+                            reconciliation = reconcile_debt(debt_df, payments)
+                        
+                        gaps = reconciliation[reconciliation['Statut'] != 'OK']
+                        
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Dette réelle", f"{reconciliation['Dette réelle (€)'].sum():.2f} €")
+                        with col2:
+                            st.metric("Écart avec l'estimation", f"{reconciliation['Écart (€)'].sum():.2f} €")
+                        with col3:
+                            st.metric("Abonnés en écart", len(gaps))
+                        
+                        st.write(f"📌 **Abonnés dont la dette réelle diffère de l'estimation :**")
+                        st.dataframe(gaps)
+                    elif order_files:
+                        st.warning("⚠️ Colonne 'ID' manquante dans les abonnements. Rapprochement impossible.")
             
             # Préparer le format final (sans Type d'abonnement et Magazines Restants)
             all_df_export = prepare_final_files(all_df)
@@ -836,6 +1026,8 @@ if uploaded_files:
                     buffer = io.BytesIO()
                     with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
                         debt_report.to_excel(writer, index=False, sheet_name='Dette Abonnements 1 an')
+                        if reconciliation is not None:
+                            reconciliation.to_excel(writer, index=False, sheet_name='Rapprochement paiements')
                     buffer.seek(0)
                     
                     # Proposer le téléchargement
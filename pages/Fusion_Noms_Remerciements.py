@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from io import BytesIO
 from docx import Document
 import unicodedata
+import re
+
+# Commentaires de refus d'apparaître (comparés sans accents ni casse)
+CONSENT_REFUSAL = re.compile(r'ne\s+(?:souhaite\s+)?pas\s+apparaitre', re.IGNORECASE)
 
 def detect_export_type(df):
     """
@@ -23,6 +28,15 @@ def detect_export_type(df):
     else:
         return 'unknown'
 
+def clean_text_column(df, column):
+    """
+    Texte nettoyé d'une colonne (espaces retirés), chaîne vide si la colonne est absente ou la valeur manquante
+    """
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    values = df[column]
+    return values.astype(str).str.strip().where(values.notna(), '')
+
 def standardize_dataframe(df, export_type):
     """
     Standardise le DataFrame selon le type d'export détecté
@@ -42,50 +56,35 @@ def standardize_dataframe(df, export_type):
         # Utiliser la colonne # comme Reference
         standardized_df['Reference'] = df['#'].astype(str).str.strip()
         
-        # Fonction pour obtenir le meilleur nom/prénom disponible
-        def get_best_name(row):
+        # Colonnes de noms nettoyées (chaîne vide si absente ou vide)
+        prenom_fact = clean_text_column(df, 'Prénom de facturation')
+        nom_fact = clean_text_column(df, 'Nom de facturation')
+        prenom_livr = clean_text_column(df, 'Prénom de livraison')
+        nom_livr = clean_text_column(df, 'Nom de livraison')
+        nom_complet = clean_text_column(df, 'Nom complet')
+        
+        # Nom complet découpé : premier mot = prénom, le reste = nom
+        parts = nom_complet.str.split(n=1)
+        prenom_complet = parts.str[0].fillna('')
+        nom_reste = parts.str[1].fillna('').str.split().str.join(' ')
+        
+        # Cascade de priorités évaluée colonne par colonne
+        conditions = [
             # Priorité 1: Nom et prénom de facturation (vrais noms)
-            prenom_fact = row.get('Prénom de facturation', '')
-            nom_fact = row.get('Nom de facturation', '')
-            
-            if (pd.notna(prenom_fact) and pd.notna(nom_fact) and 
-                str(prenom_fact).strip() and str(nom_fact).strip()):
-                return str(prenom_fact).strip(), str(nom_fact).strip()
-            
+            (prenom_fact != '') & (nom_fact != ''),
             # Priorité 2: Nom et prénom de livraison (vrais noms)
-            prenom_livr = row.get('Prénom de livraison', '')
-            nom_livr = row.get('Nom de livraison', '')
-            
-            if (pd.notna(prenom_livr) and pd.notna(nom_livr) and 
-                str(prenom_livr).strip() and str(nom_livr).strip()):
-                return str(prenom_livr).strip(), str(nom_livr).strip()
-            
+            (prenom_livr != '') & (nom_livr != ''),
             # Priorité 3: Nom complet (que ce soit un vrai nom ou un pseudo)
-            nom_complet = row.get('Nom complet', '')
-            if pd.notna(nom_complet) and str(nom_complet).strip():
-                nom_complet = str(nom_complet).strip()
-                parts = nom_complet.split()
-                
-                if len(parts) >= 2:
-                    # Premier mot = prénom, le reste = nom
-                    prenom = parts[0]
-                    nom = ' '.join(parts[1:])
-                    return prenom, nom
-                elif len(parts) == 1:
-                    return parts[0], ''
-            
+            nom_complet != '',
             # Priorité 4: Utiliser ce qui est disponible même si incomplet
-            if pd.notna(prenom_fact) and str(prenom_fact).strip():
-                return str(prenom_fact).strip(), str(nom_fact).strip() if pd.notna(nom_fact) else ''
-            if pd.notna(prenom_livr) and str(prenom_livr).strip():
-                return str(prenom_livr).strip(), str(nom_livr).strip() if pd.notna(nom_livr) else ''
-            
-            return '', ''
+            prenom_fact != '',
+            prenom_livr != ''
+        ]
+        prenoms = [prenom_fact, prenom_livr, prenom_complet, prenom_fact, prenom_livr]
+        noms = [nom_fact, nom_livr, nom_reste, nom_fact, nom_livr]
         
-        # Appliquer la logique à chaque ligne
-        names_data = df.apply(get_best_name, axis=1)
-        standardized_df['Prénom'] = [x[0] for x in names_data]
-        standardized_df['Nom'] = [x[1] for x in names_data]
+        standardized_df['Prénom'] = np.select(conditions, [col.to_numpy(dtype=object) for col in prenoms], default='')
+        standardized_df['Nom'] = np.select(conditions, [col.to_numpy(dtype=object) for col in noms], default='')
         
         # Copier les autres colonnes importantes si elles existent
         for col in ['Email', 'E-mail', 'Pseudo', 'Identifiant / Pseudonyme']:
@@ -98,6 +97,38 @@ def standardize_dataframe(df, export_type):
     else:
         raise ValueError("Type d'export non reconnu")
 
+def refuses_thanks(comments):
+    """
+    Masque des commentaires demandant à ne pas apparaître dans les remerciements (accents ignorés)
+    """
+    without_accents = comments.str.normalize('NFD').str.replace('[\u0300-\u036f]', '', regex=True)
+    return without_accents.str.contains(CONSENT_REFUSAL, na=False)
+
+def merge_changes(df_rem_std, df_changes, excluded):
+    """
+    Jointure unique entre contributeurs et changements (une ligne par commande)
+    Returns: DataFrame avec 'Nom de remplacement', 'Exclusion demandée' et l'indicateur '_merge'
+    """
+    new_names = df_changes['A faire apparaitre sur les pages Remerciements']
+    changes = pd.DataFrame({
+        'Reference': df_changes['Commande'],
+        'Exclusion demandée': excluded,
+        'Nom de remplacement': new_names.where(new_names.notna() & (new_names != ''))
+    })
+    
+    # Une commande exclue l'est pour toutes ses lignes, le dernier nom renseigné l'emporte
+    changes = changes.groupby('Reference', sort=False).agg({
+        'Exclusion demandée': 'any',
+        'Nom de remplacement': 'last'
+    })
+    changes['Nom de remplacement'] = changes['Nom de remplacement'].where(~changes['Exclusion demandée'])
+    
+    # Jointure externe : gauche seule = sans changement, droite seule = référence non trouvée
+    merged = df_rem_std.assign(_ligne=np.arange(len(df_rem_std))).merge(
+        changes.reset_index(), on='Reference', how='outer', indicator=True
+    )
+    return merged
+
 def get_export_info(export_type, df):
     """
     Retourne les informations sur le type d'export détecté
@@ -247,78 +278,66 @@ if file_rem and file_changes and file_name:
         df_changes['A faire apparaitre sur les pages Remerciements'] = df_changes['A faire apparaitre sur les pages Remerciements'].astype(str).str.strip()
         
         # Gérer la colonne Commentaire si elle existe
-        exclude_from_thanks = set()
+        excluded = pd.Series(False, index=df_changes.index)
         if 'Commentaire' in df_changes.columns:
             # Identifier les personnes qui ne souhaitent pas apparaître
             df_changes['Commentaire'] = df_changes['Commentaire'].fillna('').astype(str).str.strip()
+            excluded = refuses_thanks(df_changes['Commentaire'])
             
-            # Conditions pour exclure quelqu'un
-            exclude_conditions = df_changes['Commentaire'].str.lower().str.contains(
-                'ne souhaite pas apparaître|ne souhaite pas apparaitre|ne pas apparaître|ne pas apparaitre', 
-                regex=True, na=False
-            )
-            
-            exclude_rows = df_changes[exclude_conditions]
-            exclude_from_thanks = set(exclude_rows['Commande'].astype(str))
-            
-            if len(exclude_from_thanks) > 0:
+            if excluded.any():
+                exclude_rows = df_changes[excluded]
                 st.subheader("🚫 Exclusions demandées")
-                st.info(f"**{len(exclude_from_thanks)} personne(s) ne souhaitent pas apparaître dans les remerciements**")
+                st.info(f"**{exclude_rows['Commande'].nunique()} personne(s) ne souhaitent pas apparaître dans les remerciements**")
                 
                 # Afficher les exclusions
                 exclude_df = exclude_rows[['Commande', 'A supprimer des pages Remerciements', 'Commentaire']].copy()
                 exclude_df.columns = ['Référence', 'Nom à exclure', 'Motif']
                 st.dataframe(exclude_df, use_container_width=True)
 
-        # Vérification des correspondances
-        rem_references = set(df_rem_std['Reference'].astype(str))
-        change_references = set(df_changes['Commande'].astype(str))
+        # Jointure unique entre contributeurs et changements
+        merged = merge_changes(df_rem_std, df_changes, excluded)
+        found = merged['_merge'] == 'both'
+        not_found = merged['_merge'] == 'right_only'
         
-        matches = change_references.intersection(rem_references)
-        no_matches = change_references - rem_references
+        # Vérification des correspondances
+        change_count = merged.loc[merged['_merge'] != 'left_only', 'Reference'].nunique()
+        match_count = merged.loc[found, 'Reference'].nunique()
+        no_matches = merged.loc[not_found, 'Reference'].tolist()
         
         st.subheader("🔍 Analyse des correspondances")
         col_match1, col_match2, col_match3 = st.columns(3)
         
         with col_match1:
-            st.metric("✅ Références trouvées", len(matches))
+            st.metric("✅ Références trouvées", match_count)
         with col_match2:
             st.metric("❌ Références non trouvées", len(no_matches))
         with col_match3:
-            st.metric("📊 Taux de correspondance", f"{(len(matches)/len(change_references)*100 if change_references else 0):.1f}%")
+            st.metric("📊 Taux de correspondance", f"{(match_count/change_count*100 if change_count else 0):.1f}%")
         
         if no_matches:
-            st.warning(f"⚠️ **Références non trouvées:** {list(no_matches)}")
+            st.warning(f"⚠️ **Références non trouvées:** {no_matches}")
 
-        # Créer le dictionnaire de remplacements (en excluant ceux qui ne veulent pas apparaître)
-        replacements = {}
-        
-        for _, row in df_changes.iterrows():
-            commande = str(row['Commande'])
-            
-            # Si la personne ne veut pas apparaître, on l'exclut complètement
-            if commande in exclude_from_thanks:
-                continue
-                
-            # Si il y a un remplacement spécifié et qu'il n'est pas vide
-            nouveau_nom = row['A faire apparaitre sur les pages Remerciements']
-            if pd.notna(nouveau_nom) and nouveau_nom.strip():
-                replacements[commande] = nouveau_nom.strip()
-
-        # Appliquer les remplacements
-        df_rem_std['Nom Complet'] = df_rem_std.apply(
-            lambda row: replacements.get(str(row['Reference']), f"{row['Prénom']} {row['Nom']}"), 
-            axis=1
+        # Remplacements et exclusions issus de la même jointure
+        replacements = merged.loc[merged['_merge'] != 'left_only'].dropna(subset=['Nom de remplacement'])
+        replacements = dict(zip(replacements['Reference'], replacements['Nom de remplacement']))
+        exclude_from_thanks = set(merged.loc[merged['Exclusion demandée'].eq(True), 'Reference'])
+
+        # Contributeurs dans leur ordre d'origine, nom remplacé si demandé
+        df_rem_std = merged[~not_found].sort_values('_ligne')
+        df_rem_std['Nom Complet'] = df_rem_std['Nom de remplacement'].fillna(
+            df_rem_std['Prénom'].map(str) + ' ' + df_rem_std['Nom'].map(str)
         )
         
         # Exclure complètement les personnes qui ne souhaitent pas apparaître
         if exclude_from_thanks:
             before_exclusion = len(df_rem_std)
-            df_rem_std = df_rem_std[~df_rem_std['Reference'].astype(str).isin(exclude_from_thanks)]
+            df_rem_std = df_rem_std[~df_rem_std['Exclusion demandée'].eq(True)]
             after_exclusion = len(df_rem_std)
             
             if before_exclusion > after_exclusion:
                 st.success(f"✅ {before_exclusion - after_exclusion} personne(s) exclue(s) des remerciements comme demandé")
+        
+        df_rem_std = df_rem_std.drop(columns=['_ligne', '_merge', 'Exclusion demandée', 'Nom de remplacement']).reset_index(drop=True)
 
         # Nettoyer les espaces superflus
         df_rem_std['Nom Complet'] = df_rem_std['Nom Complet'].str.strip()
@@ -3,7 +3,30 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import io
+import os
+import hashlib
+import re
+import sqlite3
+import zipfile
+import xlsxwriter
+import openpyxl
+import pyarrow.parquet as pq
+from operator import itemgetter
+from itertools import islice
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Polars (optionnel) : moteur multi-threadé pour les très gros exports
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Catalogue local et persistant des produits (poids, SKU)
+catalog_path = os.getenv("PRODUCT_CATALOG_PATH", "product_catalog.sqlite")
+
+# En-têtes propres aux exports Shopify (Matrixify ou export natif des commandes)
+SHOPIFY_HEADERS = {'line: name', 'lineitem name', 'customer: email', 'payment: status', 'financial status'}
 
 def detect_columns(df):
     """Détecte automatiquement les colonnes importantes"""
@@ -46,25 +69,77 @@ def detect_columns(df):
             columns['line_type'] = df.columns[df_cols.index(col)]
             break
     
+    # Numéro de commande (optionnel, sert au dédoublonnage entre exports)
+    # 'Name' n'est le numéro de commande que dans un export Shopify ; ailleurs c'est souvent le nom du client
+    order_aliases = ['order: name', 'order id', 'order_id', 'order number', 'order_number']
+    if SHOPIFY_HEADERS.intersection(df_cols):
+        order_aliases.append('name')
+    for col in order_aliases:
+        if col in df_cols:
+            columns['order_id'] = df.columns[df_cols.index(col)]
+            break
+    
+    # Date de commande (optionnelle, sert à l'analyse par période) : en-têtes explicites d'abord
+    for col in ['created at', 'created_at', 'order date', 'order_date', 'processed at', 'processed_at', 'paid at']:
+        if col in df_cols:
+            columns['order_date'] = df.columns[df_cols.index(col)]
+            break
+    else:
+        # Une colonne 'date' seule n'est retenue que si aucune autre date (expédition, naissance...) n'existe
+        date_like = [col for col in df_cols if 'date' in col]
+        if date_like == ['date']:
+            columns['order_date'] = df.columns[df_cols.index('date')]
+    
+    # Nom et code postal de livraison (optionnels, servent à regrouper les emails d'un même client)
+    for col in ['shipping: name', 'shipping_name', 'shipping name']:
+        if col in df_cols:
+            columns['shipping_name'] = df.columns[df_cols.index(col)]
+            break
+    
+    for col in ['shipping: zip', 'shipping_zip', 'zip', 'postal code', 'zip code']:
+        if col in df_cols:
+            columns['zip'] = df.columns[df_cols.index(col)]
+            break
+    
     return columns
 
-def extract_products_from_orders(df, columns):
-    """Extrait tous les produits uniques des commandes"""
-    
-    # Filtrer les données
-    df_filtered = df.copy()
+def has_required_columns(columns):
+    """Vérifie la présence des colonnes indispensables (email, pays, produit)"""
+    return all(field in columns for field in ['email', 'country', 'product'])
+
+def lowered_value_mask(series, value):
+    """Équivalent de `series.str.lower() == value`, calculé une seule fois par valeur distincte"""
+    categorical = series.astype('category')
+    matching = np.flatnonzero(categorical.cat.categories.astype(str).str.lower() == value)
+    return np.isin(categorical.cat.codes.to_numpy(), matching)
+
+def combine_order_filters(row_count, paid=None, line_item=None):
+    """Combine les prédicats : commandes payées puis lignes produit, si ces valeurs existent dans l'export"""
+    mask = np.ones(row_count, dtype=bool)
     
     # Filtrer par statut si disponible
-    if 'status' in columns:
-        status_col = columns['status']
-        if 'paid' in df_filtered[status_col].str.lower().values:
-            df_filtered = df_filtered[df_filtered[status_col].str.lower() == 'paid']
+    if paid is not None and paid.any():
+        mask = paid
     
-    # Filtrer par type de ligne si disponible
-    if 'line_type' in columns:
-        line_type_col = columns['line_type']
-        if 'line item' in df_filtered[line_type_col].str.lower().values:
-            df_filtered = df_filtered[df_filtered[line_type_col].str.lower() == 'line item']
+    # Filtrer par type de ligne si disponible (parmi les lignes gardées par le statut)
+    if line_item is not None and (mask & line_item).any():
+        mask = mask & line_item
+    
+    return mask
+
+def build_order_filter(df, columns):
+    """Masque des lignes utiles de l'export"""
+    paid = lowered_value_mask(df[columns['status']], 'paid') if 'status' in columns else None
+    line_item = lowered_value_mask(df[columns['line_type']], 'line item') if 'line_type' in columns else None
+    return combine_order_filters(len(df), paid, line_item)
+
+def extract_products_from_orders(df, columns):
+    """Extrait tous les produits uniques des commandes"""
+    
+    # Un seul masque, appliqué une fois aux seules colonnes détectées
+    mask = build_order_filter(df, columns)
+    used_columns = list(dict.fromkeys(columns.values()))
+    df_filtered = df[used_columns] if mask.all() else df.loc[mask, used_columns]
     
     # Extraire les produits uniques
     product_col = columns['product']
@@ -72,554 +147,1973 @@ def extract_products_from_orders(df, columns):
     
     return unique_products, df_filtered
 
-def create_variants_by_user(df_filtered, columns):
+def create_variant_table(products):
+    """Crée la table des variants : produits et combinaisons internés par identifiant"""
+    return {
+        'products': list(products),
+        'product_ids': {product: product_id for product_id, product in enumerate(products)},
+        'keys': [],
+        'variant_ids': {},
+        # Index inversé : id produit -> ids des variants qui le contiennent
+        'variants_by_product': [set() for _ in products],
+        # Index inverse : id variant -> clients qui l'ont commandé
+        'customers_by_variant': []
+    }
+
+def intern_variant(variant_table, key):
+    """Retourne l'identifiant d'un variant (tuple trié de (id produit, quantité)), créé si besoin"""
+    variant_id = variant_table['variant_ids'].get(key)
+    if variant_id is None:
+        variant_id = len(variant_table['keys'])
+        variant_table['variant_ids'][key] = variant_id
+        variant_table['keys'].append(key)
+        variant_table['customers_by_variant'].append([])
+        for product_id, _ in key:
+            variant_table['variants_by_product'][product_id].add(variant_id)
+    return variant_id
+
+def normalize_emails(emails):
+    """Normalise les emails (espaces, casse, alias "+tag") ; calcul sur les valeurs distinctes"""
+    distinct = pd.Series(emails.dropna().unique())
+    normalized = (
+        distinct.astype(str).str.strip().str.lower()
+        .str.replace(r'\+[^@]*@', '@', regex=True)
+    )
+    return emails.map(dict(zip(distinct.tolist(), normalized.tolist())))
+
+def normalize_address_keys(shipping_names, zips):
+    """Clé de regroupement nom + code postal (None si l'un des deux manque)"""
+    distinct = pd.DataFrame({'name': shipping_names, 'zip': zips}).drop_duplicates().dropna()
+    names = distinct['name'].astype(str).str.lower().str.split().str.join(' ')
+    codes = distinct['zip'].astype(str).str.upper().str.replace(r'\s+', '', regex=True).str.lstrip("'")
+    distinct['key'] = (names + '|' + codes).where(names.str.len().gt(0) & codes.str.len().gt(0))
+    
+    # Reporter la clé de chaque couple distinct sur toutes les lignes
+    rows = pd.DataFrame({'name': shipping_names, 'zip': zips})
+    return rows.merge(distinct, on=['name', 'zip'], how='left')['key'].set_axis(shipping_names.index)
+
+def resolve_customers(emails, address_keys=None):
+    """Identifiant client par email normalisé ; les emails partageant une clé d'adresse sont regroupés (union-find)"""
+    customers = normalize_emails(emails)
+    if address_keys is None:
+        return customers
+    
+    # Index de hachage clé d'adresse -> emails, puis union des emails d'une même clé
+    pairs = pd.DataFrame({'email': customers, 'key': address_keys}).dropna().drop_duplicates()
+    parent = {}
+    
+    def find(email):
+        root = email
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while email != root:
+            parent[email], email = root, parent[email]
+        return root
+    
+    # Chaque email est relié au premier email vu avec la même clé : seules ces arêtes passent par l'union-find
+    pairs['linked'] = pairs.groupby('key', sort=False)['email'].transform('first')
+    edges = pairs[pairs['email'] != pairs['linked']]
+    for email, linked in zip(edges['email'].tolist(), edges['linked'].tolist()):
+        root, other = sorted((find(email), find(linked)))
+        if root != other:
+            parent[other] = root
+    
+    if not parent:
+        return customers
+    
+    # Le plus petit email du groupe sert d'identifiant (stable d'une analyse à l'autre)
+    resolved = {email: find(email) for email in list(parent)}
+    return customers.map(resolved).fillna(customers)
+
+def create_variants_by_user(df_filtered, columns, link_by_address=False):
     """Crée les variants en regroupant par utilisateur"""
     
     email_col = columns['email']
+    contact_col = columns.get('contact_email', email_col)
     country_col = columns['country']
     product_col = columns['product']
     quantity_col = columns.get('quantity')
     
-    user_data = {}
+    # Quantité de chaque ligne (1 si la colonne est absente ou vide)
+    if quantity_col:
+        quantities = pd.to_numeric(df_filtered[quantity_col], errors='coerce').fillna(1).astype(int)
+    else:
+        quantities = pd.Series(1, index=df_filtered.index)
     
-    # Regrouper par email
-    for email, user_orders in df_filtered.groupby(email_col):
-        country = user_orders[country_col].iloc[0]
-        
-        # Calculer les produits et quantités pour cet utilisateur
-        products = defaultdict(int)
-        for _, row in user_orders.iterrows():
-            product = row[product_col]
-            qty = int(row[quantity_col]) if quantity_col and pd.notna(row[quantity_col]) else 1
-            products[product] += qty
-        
-        # Créer le variant
-        variant_parts = []
-        for product, qty in sorted(products.items()):
-            variant_parts.append(f"{qty}x {product}")
-        variant = " + ".join(variant_parts)
-        
-        user_data[email] = {
-            'variant': variant,
+    # Identifiant client : email normalisé, éventuellement relié par nom + code postal
+    address_keys = None
+    if link_by_address and 'shipping_name' in columns and 'zip' in columns:
+        address_keys = normalize_address_keys(df_filtered[columns['shipping_name']], df_filtered[columns['zip']])
+    customers = resolve_customers(df_filtered[email_col], address_keys)
+    
+    lines = pd.DataFrame({
+        'email': customers,
+        'product': df_filtered[product_col],
+        'qty': quantities
+    })
+    lines = lines[lines['email'].notna() & lines['product'].notna()]
+    
+    # Identifiant produit = rang dans la liste triée des produits
+    products = sorted(lines['product'].unique().tolist())
+    lines['product'] = pd.Categorical(lines['product'], categories=products).codes
+    
+    # Quantités par utilisateur et par produit en une seule agrégation
+    counts = lines.groupby(['email', 'product'], sort=True)['qty'].sum()
+    
+    # Pays et email d'origine de la première ligne de chaque utilisateur
+    first_rows = pd.DataFrame({
+        'email': customers,
+        'country': df_filtered[country_col],
+        'contact': contact_emails(df_filtered[contact_col])
+    }).drop_duplicates(subset='email').set_index('email')
+    
+    # Numéros de commande de chaque utilisateur (pour retrouver les clients d'un variant)
+    orders_by_user = {}
+    if 'order_id' in columns:
+        orders = pd.DataFrame({'email': customers, 'order': df_filtered[columns['order_id']]}).dropna().drop_duplicates()
+        orders_by_user = orders.groupby('email', sort=False)['order'].agg(list).to_dict()
+    
+    return assemble_user_variants(
+        counts.index.get_level_values('email').tolist(),
+        counts.index.get_level_values('product').tolist(),
+        counts.tolist(),
+        products,
+        first_rows['country'],
+        orders_by_user,
+        first_rows['contact']
+    )
+
+def contact_emails(emails):
+    """Emails tels que saisis (espaces retirés) : affichés et exportés, l'identifiant résolu ne sert qu'au regroupement"""
+    return emails.astype(str).str.strip().where(emails.notna())
+
+def assemble_user_variants(emails, product_ids, quantities, products, first_countries, orders_by_user=None, first_contacts=None):
+    """Construit user_data et la table des variants à partir des quantités agrégées (triées par email puis produit).
+    first_contacts : premier email d'origine de chaque client (à défaut, l'identifiant résolu est affiché)"""
+    
+    # Clé canonique du variant : tuple trié de (id produit, quantité)
+    keys_by_user = defaultdict(list)
+    products_by_user = defaultdict(dict)
+    for email, product_id, qty in zip(emails, product_ids, quantities):
+        keys_by_user[email].append((product_id, qty))
+        products_by_user[email][products[product_id]] = qty
+    
+    countries = first_countries.reindex(list(keys_by_user)).tolist()
+    if first_contacts is None:
+        contacts = list(keys_by_user)
+    else:
+        contacts = [
+            contact if isinstance(contact, str) else email
+            for email, contact in zip(keys_by_user, first_contacts.reindex(list(keys_by_user)).tolist())
+        ]
+    
+    variant_table = create_variant_table(products)
+    orders_by_user = orders_by_user or {}
+    user_data = {
+        email: {
+            'variant': intern_variant(variant_table, tuple(key)),
+            'email': contact,
             'country': country,
-            'products': dict(products)
+            'products': products_by_user[email],
+            'orders': orders_by_user.get(email, [])
         }
+        for (email, key), country, contact in zip(keys_by_user.items(), countries, contacts)
+    }
+    
+    # Index inverse variant -> clients, rempli sans relire les commandes
+    customers_by_variant = variant_table['customers_by_variant']
+    for email, data in user_data.items():
+        customers_by_variant[data['variant']].append(email)
+    
+    return user_data, variant_table
+
+def has_mixed_types(frame):
+    """Vrai si une colonne texte mélange plusieurs types (fréquent en XLSX) : non convertible telle quelle en Polars"""
+    for col_name in frame.columns:
+        values = frame[col_name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.categories
+        elif values.dtype != object:
+            continue
+        if pd.api.types.infer_dtype(values, skipna=True).startswith('mixed'):
+            return True
+    return False
+
+def extract_products_from_orders_polars(df, columns):
+    """Variante Polars de extract_products_from_orders : prédicats évalués en parallèle"""
+    used_columns = list(dict.fromkeys(columns.values()))
+    
+    # Colonnes aux types mélangés : le moteur pandas donne le même résultat sans conversion
+    if has_mixed_types(df[[columns[field] for field in ('status', 'line_type', 'product') if field in columns]]):
+        return extract_products_from_orders(df, columns)
+    
+    predicates = {}
+    if 'status' in columns:
+        predicates['paid'] = pl.col(columns['status']).cast(pl.Utf8).str.to_lowercase() == 'paid'
+    if 'line_type' in columns:
+        predicates['line_item'] = pl.col(columns['line_type']).cast(pl.Utf8).str.to_lowercase() == 'line item'
+    
+    if predicates:
+        filter_columns = [columns[field] for field in ('status', 'line_type') if field in columns]
+        flags = pl.from_pandas(df[filter_columns]).lazy().select(
+            **{name: predicate.fill_null(False) for name, predicate in predicates.items()}
+        ).collect()
+        mask = combine_order_filters(
+            len(df), **{name: flags[name].to_numpy() for name in predicates}
+        )
+    else:
+        mask = np.ones(len(df), dtype=bool)
     
-    return user_data
+    df_filtered = df[used_columns] if mask.all() else df.loc[mask, used_columns]
+    unique_products = pl.from_pandas(df_filtered[columns['product']]).drop_nulls().unique().sort().to_list()
+    return unique_products, df_filtered
+
+def create_variants_by_user_polars(df_filtered, columns, link_by_address=False):
+    """Variante Polars de create_variants_by_user : agrégations en lazy frames multi-threadées, résultat identique"""
+    
+    # Identifiant client : même résolution que le moteur pandas
+    address_keys = None
+    if link_by_address and 'shipping_name' in columns and 'zip' in columns:
+        address_keys = normalize_address_keys(df_filtered[columns['shipping_name']], df_filtered[columns['zip']])
+    customers = resolve_customers(df_filtered[columns['email']], address_keys)
+    
+    quantity_col = columns.get('quantity')
+    order_col = columns.get('order_id')
+    lines = pd.DataFrame({
+        'email': customers,
+        'product': df_filtered[columns['product']],
+        # Quantités numériques avant conversion (texte et nombres mélangés dans les XLSX)
+        'qty': pd.to_numeric(df_filtered[quantity_col], errors='coerce') if quantity_col else 1,
+        'order': df_filtered[order_col] if order_col else None
+    })
+    
+    # Autres colonnes aux types mélangés : repli sur le moteur pandas (résultat identique)
+    if has_mixed_types(lines):
+        return create_variants_by_user(df_filtered, columns, link_by_address)
+    # Le pays est relu dans l'export d'origine par position de ligne (valeurs manquantes et types conservés)
+    lines = pl.from_pandas(lines).lazy().with_row_index('row')
+    
+    # Quantité de chaque ligne (1 si la colonne est absente ou vide), tronquée comme avec pandas
+    quantity = pl.col('qty').cast(pl.Float64, strict=False).fill_nan(None).fill_null(1).cast(pl.Int64)
+    counts_plan = (
+        lines.filter(pl.col('email').is_not_null() & pl.col('product').is_not_null())
+        .group_by(['email', 'product'])
+        .agg(quantity.sum().alias('qty'))
+        .sort(['email', 'product'])
+    )
+    first_plan = (
+        lines.filter(pl.col('email').is_not_null())
+        .group_by('email', maintain_order=True)
+        .agg(pl.col('row').first(), pl.col('order').drop_nulls().unique(maintain_order=True))
+    )
+    counts, first_rows = pl.collect_all([counts_plan, first_plan])
+    
+    # Identifiant produit = rang dans la liste triée des produits
+    products = counts['product'].unique().sort().to_list()
+    product_ids = {product: product_id for product_id, product in enumerate(products)}
+    
+    first_positions = first_rows['row'].to_numpy()
+    first_emails = first_rows['email'].to_list()
+    return assemble_user_variants(
+        counts['email'].to_list(),
+        [product_ids[product] for product in counts['product'].to_list()],
+        counts['qty'].to_list(),
+        products,
+        pd.Series(df_filtered[columns['country']].to_numpy()[first_positions], index=first_emails, dtype=object),
+        {email: orders for email, orders in zip(first_emails, first_rows['order'].to_list()) if orders},
+        pd.Series(
+            contact_emails(df_filtered[columns.get('contact_email', columns['email'])]).to_numpy()[first_positions],
+            index=first_emails,
+            dtype=object
+        )
+    )
+
+# Moteurs de calcul disponibles : (filtrage des lignes, regroupement en variants)
+PIPELINE_BACKENDS = {'pandas': (extract_products_from_orders, create_variants_by_user)}
+if pl is not None:
+    PIPELINE_BACKENDS['polars'] = (extract_products_from_orders_polars, create_variants_by_user_polars)
+
+# Traduction des pays en français (libellés des colonnes du rapport)
+COUNTRY_TRANSLATION = {
+    'France': 'France',
+    'Belgium': 'Belgique', 
+    'Switzerland': 'Suisse',
+    'Canada': 'Canada',
+    'United States': 'États-Unis',
+    'Germany': 'Allemagne',
+    'Spain': 'Espagne',
+    'Italy': 'Italie',
+    'Netherlands': 'Pays-Bas',
+    'United Kingdom': 'Royaume-Uni',
+    'Luxembourg': 'Luxembourg',
+    'Austria': 'Autriche',
+    'Portugal': 'Portugal',
+    'Denmark': 'Danemark',
+    'Finland': 'Finlande',
+    'Sweden': 'Suède',
+    'Norway': 'Norvège',
+    'Ireland': 'Irlande',
+    'Poland': 'Pologne',
+    'Czech Republic': 'République tchèque',
+    'Hungary': 'Hongrie',
+    'Greece': 'Grèce',
+    'Reunion': 'La Réunion',
+    'Guadeloupe': 'Guadeloupe',
+    'Martinique': 'Martinique',
+    'French Guiana': 'Guyane française',
+    'New Caledonia': 'Nouvelle-Calédonie',
+    'French Polynesia': 'Polynésie française',
+    'Monaco': 'Monaco',
+    'Mayotte': 'Mayotte',
+    'Saint Pierre and Miquelon': 'Saint-Pierre-et-Miquelon'
+}
 
 def translate_countries(countries):
     """Traduit les noms de pays en français"""
-    translation = {
-        'France': 'France',
-        'Belgium': 'Belgique', 
-        'Switzerland': 'Suisse',
-        'Canada': 'Canada',
-        'United States': 'États-Unis',
-        'Germany': 'Allemagne',
-        'Spain': 'Espagne',
-        'Italy': 'Italie',
-        'Netherlands': 'Pays-Bas',
-        'United Kingdom': 'Royaume-Uni',
-        'Luxembourg': 'Luxembourg',
-        'Austria': 'Autriche',
-        'Portugal': 'Portugal',
-        'Denmark': 'Danemark',
-        'Finland': 'Finlande',
-        'Sweden': 'Suède',
-        'Norway': 'Norvège',
-        'Ireland': 'Irlande',
-        'Poland': 'Pologne',
-        'Czech Republic': 'République tchèque',
-        'Hungary': 'Hongrie',
-        'Greece': 'Grèce',
-        'Reunion': 'La Réunion',
-        'Guadeloupe': 'Guadeloupe',
-        'Martinique': 'Martinique',
-        'French Guiana': 'Guyane française',
-        'New Caledonia': 'Nouvelle-Calédonie',
-        'French Polynesia': 'Polynésie française',
-        'Monaco': 'Monaco',
-        'Mayotte': 'Mayotte',
-        'Saint Pierre and Miquelon': 'Saint-Pierre-et-Miquelon'
+    return [COUNTRY_TRANSLATION.get(country, country) for country in countries]
+
+def render_variant(variant_table, variant_id, main_product=None):
+    """Affiche un variant ("1× Produit A + 2× Produit B") avec le produit principal en premier"""
+    products = variant_table['products']
+    main_id = variant_table['product_ids'].get(main_product)
+    key = variant_table['keys'][variant_id]
+    
+    parts = [f"{qty}× {products[product_id]}" for product_id, qty in key if product_id == main_id]
+    parts += [f"{qty}× {products[product_id]}" for product_id, qty in key if product_id != main_id]
+    return ' + '.join(parts)
+
+def build_variant_matrices(user_data, variant_table):
+    """Construit les matrices variant × produit (creuse) et variant × pays"""
+    
+    keys = variant_table['keys']
+    n_variants = len(keys)
+    
+    # Matrice creuse des quantités au format coordonnées (ligne = variant, colonne = produit)
+    rows = np.repeat(np.arange(n_variants), [len(key) for key in keys])
+    pairs = np.array([pair for key in keys for pair in key], dtype=np.int64).reshape(-1, 2)
+    
+    # Matrice dense des utilisateurs par variant et par pays
+    variant_ids = np.fromiter((data['variant'] for data in user_data.values()), dtype=np.int64, count=len(user_data))
+    country_codes, countries = pd.factorize(
+        pd.Series([data['country'] for data in user_data.values()], dtype=object),
+        use_na_sentinel=False
+    )
+    n_countries = len(countries)
+    counts = np.bincount(
+        variant_ids * n_countries + country_codes,
+        minlength=n_variants * n_countries
+    ).reshape(n_variants, n_countries)
+    
+    # Les totaux et l'étranger (non-France) ne dépendent pas des poids : calculés une seule fois
+    total = counts.sum(axis=1)
+    countries = list(countries)
+    france = counts[:, countries.index('France')] if 'France' in countries else 0
+    
+    return {
+        'rows': rows,
+        'product_ids': pairs[:, 0],
+        'quantities': pairs[:, 1],
+        'countries': countries,
+        'counts': counts,
+        'total': total,
+        'foreign': total - france
     }
-    return [translation.get(country, country) for country in countries]
-
-def reorder_variant_with_main_product_first(variant, main_product):
-    """Réorganise le variant pour mettre le produit principal en premier"""
-    
-    # Séparer les parties du variant
-    parts = variant.split(' + ')
-    main_part = None
-    other_parts = []
-    
-    for part in parts:
-        # Extraire le nom du produit (après "1x ", "2x ", etc.)
-        if '× ' in part:
-            product_name = part.split('× ', 1)[1]
-        elif 'x ' in part:
-            product_name = part.split('x ', 1)[1]
-        else:
-            product_name = part
-        
-        if product_name.strip() == main_product:
-            main_part = part
-        else:
-            other_parts.append(part)
+
+def calculate_weight_and_foreign(matrices, variant_table, product_weights):
+    """Calcule le poids estimé et le nombre d'utilisateurs à l'étranger de tous les variants"""
     
-    # Reconstruire avec le produit principal en premier
-    if main_part:
-        reordered_parts = [main_part] + sorted(other_parts)
-        return ' + '.join(reordered_parts)
-    else:
-        return variant  # Si pas trouvé, retourner l'original
+    # Seul le produit matrice creuse × vecteur des poids est recalculé quand un poids change
+    weight_vector = np.array([product_weights.get(product, 0.0) for product in variant_table['products']])
+    weights = np.bincount(
+        matrices['rows'],
+        weights=matrices['quantities'] * weight_vector[matrices['product_ids']],
+        minlength=len(variant_table['keys'])
+    )
+    
+    return {
+        'weight': weights,
+        'total': matrices['total'],
+        'foreign': matrices['foreign']
+    }
 
-def calculate_weight_and_foreign(variants, user_data, product_weights):
-    """Calcule le poids estimé et le nombre d'utilisateurs à l'étranger"""
+def calculate_product_cooccurrence(matrices, variant_table, top_k=5):
+    """Produits commandés ensemble : nombre de clients par paire, lift et top-k des associations par produit"""
+    products = variant_table['products']
+    n_products = len(products)
+    rows = matrices['rows']
+    product_ids = matrices['product_ids']
     
-    results = {}
+    # Produit creux Bᵀ·W·B (B = présence variant × produit, W = clients par variant) :
+    # chaque entrée de la matrice COO est appariée aux entrées de son variant, puis un bincount somme les paires
+    sizes = np.bincount(rows, minlength=len(variant_table['keys']))
+    starts = np.cumsum(sizes) - sizes
+    repeats = sizes[rows]
+    left = np.repeat(np.arange(len(rows)), repeats)
+    right = starts[rows[left]] + np.arange(len(left)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    together = np.bincount(
+        product_ids[left] * n_products + product_ids[right],
+        weights=matrices['total'][rows[left]],
+        minlength=n_products * n_products
+    ).reshape(n_products, n_products)
     
-    for variant, countries in variants:
-        # Calculer le poids estimé
-        total_weight = 0.0
-        parts = variant.split(' + ')
-        
-        for part in parts:
-            # Extraire quantité et produit
-            if '× ' in part:
-                qty_str, product = part.split('× ', 1)
-            elif 'x ' in part:
-                qty_str, product = part.split('x ', 1)
-            else:
-                qty_str, product = '1', part
-            
-            try:
-                qty = int(qty_str)
-            except:
-                qty = 1
-            
-            weight = product_weights.get(product.strip(), 0.0)  # Utiliser le poids configuré
-            total_weight += qty * weight
-        
-        # Calculer les utilisateurs à l'étranger (non-France)
-        total_users = sum(countries.values())
-        france_users = countries.get('France', 0)
-        foreign_users = total_users - france_users
-        
-        results[variant] = {
-            'weight': f"{total_weight:.3f}kg",
-            'total': total_users,
-            'foreign': foreign_users
-        }
+    # Lift = P(A et B) / (P(A) × P(B)) : > 1 quand les produits partent ensemble plus que par hasard
+    customers = float(matrices['total'].sum())
+    support = np.diag(together)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lift = together * customers / np.outer(support, support)
+        confidence = together / support[:, None]
     
-    return results
-    """Crée les variants en regroupant par utilisateur"""
+    # Paires distinctes (A < B) vendues ensemble au moins une fois, les plus fréquentes d'abord
+    first, second = np.nonzero(np.triu(together, k=1))
+    order = np.lexsort((second, first, -together[first, second]))
+    first, second = first[order], second[order]
+    pairs = pd.DataFrame({
+        'Produit A': [products[product_id] for product_id in first],
+        'Produit B': [products[product_id] for product_id in second],
+        'Clients (ensemble)': together[first, second].astype(int),
+        'Lift': lift[first, second].round(2)
+    })
     
-    email_col = columns['email']
-    country_col = columns['country']
-    product_col = columns['product']
-    quantity_col = columns.get('quantity')
+    # Top-k des produits associés à chaque produit (argsort par ligne, sans boucle sur les paires)
+    partners = np.where(np.eye(n_products, dtype=bool), -1, together)
+    ranked = np.argsort(-partners, axis=1, kind='stable')[:, :top_k]
+    product_rows = np.repeat(np.arange(n_products), ranked.shape[1])
+    partner_rows = ranked.ravel()
+    kept = partners[product_rows, partner_rows] > 0
+    product_rows, partner_rows = product_rows[kept], partner_rows[kept]
+    top = pd.DataFrame({
+        'Produit': [products[product_id] for product_id in product_rows],
+        'Produit associé': [products[product_id] for product_id in partner_rows],
+        'Clients (ensemble)': together[product_rows, partner_rows].astype(int),
+        '% des clients du produit': (confidence[product_rows, partner_rows] * 100).round(1),
+        'Lift': lift[product_rows, partner_rows].round(2)
+    })
+    
+    return {'pairs': pairs, 'top': top}
+
+# Zones d'expédition des pays (noms anglais des exports Shopify), les autres pays sont en zone Monde
+SHIPPING_ZONES = {
+    'France': 'France',
+    'Monaco': 'France',
+    'Reunion': 'Outre-mer',
+    'Guadeloupe': 'Outre-mer',
+    'Martinique': 'Outre-mer',
+    'French Guiana': 'Outre-mer',
+    'Mayotte': 'Outre-mer',
+    'New Caledonia': 'Outre-mer',
+    'French Polynesia': 'Outre-mer',
+    'Saint Pierre and Miquelon': 'Outre-mer',
+    'Belgium': 'Europe',
+    'Switzerland': 'Europe',
+    'Germany': 'Europe',
+    'Spain': 'Europe',
+    'Italy': 'Europe',
+    'Netherlands': 'Europe',
+    'United Kingdom': 'Europe',
+    'Luxembourg': 'Europe',
+    'Austria': 'Europe',
+    'Portugal': 'Europe',
+    'Denmark': 'Europe',
+    'Finland': 'Europe',
+    'Sweden': 'Europe',
+    'Norway': 'Europe',
+    'Ireland': 'Europe',
+    'Poland': 'Europe',
+    'Czech Republic': 'Europe',
+    'Hungary': 'Europe',
+    'Greece': 'Europe'
+}
+
+# Barème indicatif par défaut (poids maximum de la tranche × zone -> prix), modifiable dans l'interface
+DEFAULT_SHIPPING_RATES = pd.DataFrame({
+    'Zone': ['France'] * 5 + ['Outre-mer'] * 5 + ['Europe'] * 5 + ['Monde'] * 5,
+    'Poids max (kg)': [0.5, 1.0, 2.0, 5.0, 30.0] * 4,
+    'Prix (€)': [
+        7.50, 9.00, 10.50, 16.00, 33.00,
+        15.00, 21.00, 29.00, 44.00, 160.00,
+        16.00, 20.00, 22.00, 28.00, 60.00,
+        26.00, 30.00, 42.00, 58.00, 140.00
+    ]
+})
+
+def calculate_shipping_costs(matrices, weights, shipping_rates):
+    """Estime les frais de port de chaque variant par recherche vectorisée dans le barème poids × zone"""
     
-    user_data = {}
+    zones = np.array([SHIPPING_ZONES.get(country, 'Monde') for country in matrices['countries']])
+    unit_costs = np.full(matrices['counts'].shape, np.nan)
+    rated_zones = np.zeros(len(zones), dtype=bool)
     
-    # Regrouper par email
-    for email, user_orders in df_filtered.groupby(email_col):
-        country = user_orders[country_col].iloc[0]
-        
-        # Calculer les produits et quantités pour cet utilisateur
-        products = defaultdict(int)
-        for _, row in user_orders.iterrows():
-            product = row[product_col]
-            qty = int(row[quantity_col]) if quantity_col and pd.notna(row[quantity_col]) else 1
-            products[product] += qty
-        
-        # Créer le variant
-        variant_parts = []
-        for product, qty in sorted(products.items()):
-            variant_parts.append(f"{qty}x {product}")
-        variant = " + ".join(variant_parts)
-        
-        user_data[email] = {
-            'variant': variant,
-            'country': country,
-            'products': dict(products)
-        }
+    for zone, zone_rates in shipping_rates.dropna().groupby('Zone'):
+        rated_zones |= zones == zone
+        zone_rates = zone_rates.sort_values('Poids max (kg)')
+        # Tranche = première limite >= poids ; au-delà de la dernière tranche : hors barème (NaN)
+        brackets = np.searchsorted(zone_rates['Poids max (kg)'].to_numpy(dtype=float), weights, side='left')
+        prices = np.append(zone_rates['Prix (€)'].to_numpy(dtype=float), np.nan)[brackets]
+        unit_costs[:, zones == zone] = prices[:, None]
+    
+    # Deux causes distinctes de variant non chiffré : zone sans aucun tarif, ou poids au-delà de la dernière tranche
+    shipped = matrices['counts'] > 0
+    no_rates = (shipped & ~rated_zones).any(axis=1)
+    over_limit = (shipped & rated_zones & np.isnan(unit_costs)).any(axis=1)
     
-    return user_data
+    return {
+        # Partiel pour les variants non chiffrés (seules les zones chiffrées sont additionnées)
+        'total': np.nansum(unit_costs * matrices['counts'], axis=1),
+        'no_rates': no_rates,
+        'over_limit': over_limit,
+        'unpriced': no_rates | over_limit
+    }
 
-def organize_by_user_order(user_data, ordered_products):
+def organize_by_user_order(user_data, ordered_products, variant_table):
     """Organise les variants selon l'ordre choisi par l'utilisateur"""
     
-    # Analyser les variants par pays
-    variant_stats = defaultdict(lambda: defaultdict(int))
-    for data in user_data.values():
-        variant_stats[data['variant']][data['country']] += 1
+    # Variants présents dans les données
+    present_variants = {data['variant'] for data in user_data.values()}
+    
+    keys = variant_table['keys']
     
     # Organiser par sections selon l'ordre utilisateur
     sections = {}
     used_variants = set()
     
-    # Traiter chaque produit dans l'ordre choisi
+    # Traiter chaque produit dans l'ordre choisi : variants contenant ce produit, pas encore utilisés
     for product in ordered_products:
-        section_variants = []
+        product_id = variant_table['product_ids'].get(product)
+        if product_id is None:
+            continue
         
-        for variant, countries in variant_stats.items():
-            if variant in used_variants:
-                continue
-            
-            # Ce variant contient-il ce produit ?
-            if product in variant:
-                # Réorganiser le variant avec le produit principal en premier
-                reordered_variant = reorder_variant_with_main_product_first(variant, product)
-                section_variants.append((reordered_variant, countries))
-                used_variants.add(variant)
+        section_ids = (variant_table['variants_by_product'][product_id] & present_variants) - used_variants
+        used_variants |= section_ids
         
-        if section_variants:
-            # Trier par ordre alphabétique au lieu de popularité
-            section_variants.sort(key=lambda x: x[0])
-            sections[product] = section_variants
+        if section_ids:
+            # Trier comme à l'affichage : quantité du produit principal puis autres produits
+            sections[product] = sorted(section_ids, key=lambda variant_id: (
+                dict(keys[variant_id])[product_id],
+                tuple(part for part in keys[variant_id] if part[0] != product_id)
+            ))
     
     # Ajouter les variants restants
-    remaining = []
-    for variant, countries in variant_stats.items():
-        if variant not in used_variants:
-            remaining.append((variant, countries))
+    remaining = present_variants - used_variants
     
     if remaining:
-        remaining.sort(key=lambda x: x[0])  # Alphabétique aussi
-        sections["Autres combinaisons"] = remaining
+        sections["Autres combinaisons"] = sorted(remaining, key=lambda variant_id: keys[variant_id])
     
     return sections
 
-def create_final_dataframe(sections, user_data, product_weights):
-    """Crée le DataFrame final organisé avec colonnes poids et étranger"""
+def pack_first_fit_decreasing(item_weights, max_weight, max_items=None):
+    """Répartit des articles en colis (first-fit decreasing) ; renvoie le contenu de chaque colis.
+    Un article plus lourd que la limite part seul dans son colis."""
+    parcels = []
+    for weight in sorted(item_weights, reverse=True):
+        for parcel in parcels:
+            if parcel['remaining'] >= weight - 1e-9 and (not max_items or len(parcel['items']) < max_items):
+                parcel['remaining'] -= weight
+                parcel['items'].append(weight)
+                break
+        else:
+            parcels.append({'remaining': max_weight - weight, 'items': [weight]})
+    return [parcel['items'] for parcel in parcels]
+
+def plan_variant_parcels(variant_ids, variant_table, product_weights, max_weight, max_items=None):
+    """Nombre de colis par variant : un seul calcul par variant distinct, partagé par tous ses clients"""
+    unit_weights = [product_weights.get(product, 0.0) for product in variant_table['products']]
+    parcels = np.zeros(len(variant_table['keys']), dtype=np.int64)
+    oversize = np.zeros(len(variant_table['keys']), dtype=bool)
+    plans = {}
     
-    # Obtenir tous les pays et les traduire
-    all_countries = set()
-    for section_variants in sections.values():
-        for _, countries in section_variants:
-            all_countries.update(countries.keys())
+    for variant_id in variant_ids:
+        items = tuple(sorted(
+            weight
+            for product_id, qty in variant_table['keys'][variant_id]
+            for weight in [unit_weights[product_id]] * qty
+        ))
+        # Deux variants aux mêmes poids d'articles ont le même plan
+        if items not in plans:
+            plans[items] = len(pack_first_fit_decreasing(items, max_weight, max_items))
+        parcels[variant_id] = plans[items]
+        oversize[variant_id] = bool(items) and items[-1] > max_weight
     
-    all_countries = sorted(translate_countries(list(all_countries)))
+    return {'parcels': parcels, 'oversize': oversize}
+
+def create_final_dataframe(sections, variant_table, matrices, product_weights, shipping_rates=None, parcel_limits=None):
+    """Crée le DataFrame final organisé avec colonnes poids et étranger (et frais de port si barème fourni,
+    colis par pack si des limites de colis sont données)"""
     
-    # Variables pour le total
-    total_packs = 0
-    total_foreign = 0
-    country_totals = {country: 0 for country in all_countries}
+    variant_stats = calculate_weight_and_foreign(matrices, variant_table, product_weights)
     
-    # Construire le DataFrame
-    rows = []
+    # Pivot variant × pays, colonnes traduites une seule fois (pays identiques après traduction fusionnés)
+    labels = ['Inconnu' if pd.isna(country) else country for country in translate_countries(matrices['countries'])]
+    pivot = pd.DataFrame(matrices['counts'].T, index=labels).groupby(level=0, sort=True).sum()
+    all_countries = pivot.index.tolist()
+    counts = pivot.to_numpy().T
     
-    for section_name, variants in sections.items():
-        # Titre de section
-        title_row = {
-            'Variant': f"--- {section_name.upper()} ---", 
-            'Poids des packs': '',
-            'Nombre de packs': '',
-            'Packs en livraison à l\'étranger': ''
-        }
-        for country in all_countries:
-            title_row[country] = ''
-        rows.append(title_row)
-        
-        # Calculer poids et étranger pour cette section
-        variant_stats = calculate_weight_and_foreign(variants, user_data, product_weights)
-        
-        # Variants de la section
-        for variant, countries in variants:
-            stats = variant_stats[variant]
-            
-            # Traduire les noms de pays dans les données
-            translated_countries = {}
-            country_translation = {
-                'France': 'France',
-                'Belgium': 'Belgique', 
-                'Switzerland': 'Suisse',
-                'Canada': 'Canada',
-                'United States': 'États-Unis',
-                'Germany': 'Allemagne',
-                'Spain': 'Espagne',
-                'Italy': 'Italie',
-                'Netherlands': 'Pays-Bas',
-                'United Kingdom': 'Royaume-Uni',
-                'Luxembourg': 'Luxembourg',
-                'Austria': 'Autriche',
-                'Portugal': 'Portugal',
-                'Denmark': 'Danemark',
-                'Finland': 'Finlande',
-                'Sweden': 'Suède',
-                'Norway': 'Norvège',
-                'Ireland': 'Irlande',
-                'Poland': 'Pologne',
-                'Czech Republic': 'République tchèque',
-                'Hungary': 'Hongrie',
-                'Greece': 'Grèce',
-                'Reunion': 'La Réunion',
-                'Guadeloupe': 'Guadeloupe',
-                'Martinique': 'Martinique',
-                'French Guiana': 'Guyane française',
-                'New Caledonia': 'Nouvelle-Calédonie',
-                'French Polynesia': 'Polynésie française',
-                'Monaco': 'Monaco',
-                'Mayotte': 'Mayotte',
-                'Saint Pierre and Miquelon': 'Saint-Pierre-et-Miquelon'
-            }
-            
-            for original_country, count in countries.items():
-                french_country = country_translation.get(original_country, original_country)
-                translated_countries[french_country] = count
-            
-            # Ajouter aux totaux
-            total_packs += stats['total']
-            total_foreign += stats['foreign']
-            for country in all_countries:
-                country_totals[country] += translated_countries.get(country, 0)
-            
-            row = {
-                'Variant': variant.replace('x ', '× '),
-                'Poids des packs': stats['weight'],
-                'Nombre de packs': stats['total'],
-                'Packs en livraison à l\'étranger': stats['foreign']
-            }
-            
-            for country in all_countries:
-                row[country] = translated_countries.get(country, 0)
-            
-            rows.append(row)
-        
-        # Ligne vide
-        empty_row = {
-            'Variant': '', 
-            'Poids des packs': '',
-            'Nombre de packs': '',
-            'Packs en livraison à l\'étranger': ''
-        }
-        for country in all_countries:
-            empty_row[country] = ''
-        rows.append(empty_row)
-    
-    # Ajouter la ligne de TOTAL à la fin
-    total_row = {
-        'Variant': 'TOTAL PACKS',
-        'Poids des packs': '',  # Pas de poids total comme demandé
-        'Nombre de packs': total_packs,
-        'Packs en livraison à l\'étranger': total_foreign
+    stat_columns = ['Variant', 'Poids des packs', 'Nombre de packs', 'Packs en livraison à l\'étranger']
+    if shipping_rates is not None:
+        stat_columns.append('Frais de port (€)')
+    if parcel_limits is not None:
+        stat_columns += ['Colis par pack', 'Hors limite', 'Colis']
+    country_start = len(stat_columns)
+    columns = stat_columns + all_countries
+    
+    # Positions des blocs : titre, variants de la section, ligne vide ; puis la ligne TOTAL PACKS
+    sizes = np.array([len(variant_ids) for variant_ids in sections.values()], dtype=np.int64)
+    title_rows = np.cumsum(sizes + 2) - (sizes + 2)
+    body_rows = np.repeat(title_rows + 1, sizes) + np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    total_row = int((sizes + 2).sum())
+    
+    variant_ids = np.array([variant_id for ids in sections.values() for variant_id in ids], dtype=np.int64)
+    section_counts = counts[variant_ids]
+    
+    table = np.full((total_row + 1 + (parcel_limits is not None), len(columns)), '', dtype=object)
+    table[title_rows, 0] = [f"--- {section_name.upper()} ---" for section_name in sections]
+    table[body_rows, 0] = [
+        render_variant(variant_table, variant_id, section_name)
+        for section_name, ids in sections.items() for variant_id in ids
+    ]
+    table[body_rows, 1] = [f"{weight:.3f}kg" for weight in variant_stats['weight'][variant_ids]]
+    table[body_rows, 2] = variant_stats['total'][variant_ids].tolist()
+    table[body_rows, 3] = variant_stats['foreign'][variant_ids].tolist()
+    table[body_rows, country_start:] = section_counts.tolist()
+    
+    # Ligne de TOTAL à partir des sommes de colonnes (pas de poids total comme demandé)
+    table[total_row, 0] = 'TOTAL PACKS'
+    table[total_row, 2] = int(variant_stats['total'][variant_ids].sum())
+    table[total_row, 3] = int(variant_stats['foreign'][variant_ids].sum())
+    table[total_row, country_start:] = section_counts.sum(axis=0).tolist()
+    
+    if shipping_rates is not None:
+        shipping = calculate_shipping_costs(matrices, variant_stats['weight'], shipping_rates)
+        costs = shipping['total'][variant_ids].round(2)
+        unpriced = shipping['unpriced'][variant_ids]
+        # Un variant partiellement chiffré n'a pas de montant et n'entre pas dans le total
+        table[body_rows, 4] = [
+            'Zone sans tarif' if no_rates else 'Hors barème' if over_limit else cost
+            for cost, no_rates, over_limit in zip(
+                costs.tolist(), shipping['no_rates'][variant_ids].tolist(), shipping['over_limit'][variant_ids].tolist()
+            )
+        ]
+        table[total_row, 4] = round(float(costs[~unpriced].sum()), 2)
+    
+    if parcel_limits is not None:
+        # Colis par pack (plan par variant), puis colis par pays sur une ligne TOTAL COLIS
+        plan = plan_variant_parcels(variant_ids.tolist(), variant_table, product_weights, **parcel_limits)
+        parcels = plan['parcels'][variant_ids]
+        parcel_column = columns.index('Colis par pack')
+        # Colonne numérique ; un article plus lourd que la limite est signalé dans une colonne à part
+        table[body_rows, parcel_column] = parcels.tolist()
+        table[body_rows, parcel_column + 1] = ['⚠️' if oversize else '' for oversize in plan['oversize'][variant_ids].tolist()]
+        table[body_rows, parcel_column + 2] = (parcels * variant_stats['total'][variant_ids]).tolist()
+        table[total_row, parcel_column + 2] = int((parcels * variant_stats['total'][variant_ids]).sum())
+        table[total_row + 1, 0] = 'TOTAL COLIS'
+        table[total_row + 1, parcel_column + 2] = table[total_row, parcel_column + 2]
+        table[total_row + 1, country_start:] = (section_counts * parcels[:, None]).sum(axis=0).tolist()
+    
+    # Métadonnées de mise en page transmises à l'export Excel (indices de lignes de données)
+    layout = {
+        'titles': title_rows.tolist(),
+        'blanks': (title_rows + sizes + 1).tolist(),
+        'total': total_row,
+        'parcel_total': total_row + 1 if parcel_limits is not None else None,
+        'country_start': country_start,
+        # Ligne du rapport -> id du variant (pour retrouver ses clients)
+        'variant_rows': dict(zip(body_rows.tolist(), variant_ids.tolist()))
     }
     
-    for country in all_countries:
-        total_row[country] = country_totals[country]
+    return pd.DataFrame(table, columns=columns), layout
+
+def create_parcel_dataframe(final_df, layout):
+    """Colis par variant et par pays (packs du pays × colis par pack), avec une ligne TOTAL COLIS"""
+    rows = sorted(layout['variant_rows'])
+    countries = final_df.columns[layout['country_start']:].tolist()
+    per_pack = final_df['Colis par pack'].iloc[rows].to_numpy(dtype=np.int64)
+    parcels = final_df[countries].iloc[rows].to_numpy(dtype=np.int64) * per_pack[:, None]
     
-    rows.append(total_row)
+    parcel_df = pd.DataFrame(parcels, columns=countries)
+    parcel_df.insert(0, 'Variant', final_df['Variant'].iloc[rows].tolist())
+    parcel_df.insert(1, 'Colis par pack', per_pack)
+    parcel_df.insert(2, 'Hors limite', final_df['Hors limite'].iloc[rows].tolist())
+    parcel_df.insert(3, 'Colis', parcels.sum(axis=1))
     
-    return pd.DataFrame(rows)
+    total = ['TOTAL COLIS', '', '', int(parcels.sum())] + parcels.sum(axis=0).tolist()
+    return pd.concat([parcel_df, pd.DataFrame([total], columns=parcel_df.columns)], ignore_index=True)
+
+def hash_report_inputs(*inputs):
+    """Empreinte des paramètres d'un rapport (tableaux compris) : un rapport conservé n'est réaffiché que si elle est inchangée"""
+    digest = hashlib.sha256()
+    for value in inputs:
+        if isinstance(value, pd.DataFrame):
+            value = value.to_csv(index=False)
+        digest.update(repr(value).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def build_customer_index(variant_ids, variant_table, user_data, labels=None):
+    """Liste des clients (email d'origine, pays, commandes) des variants donnés, dans l'ordre des variants"""
+    rows = [
+        (
+            labels[position] if labels else render_variant(variant_table, variant_id),
+            user_data[customer]['email'],
+            user_data[customer]['country'],
+            ', '.join(map(str, user_data[customer]['orders']))
+        )
+        for position, variant_id in enumerate(variant_ids)
+        for customer in variant_table['customers_by_variant'][variant_id]
+    ]
+    customers = pd.DataFrame(rows, columns=['Variant', 'Email', 'Pays', 'Commandes'])
+    customers['Pays'] = translate_countries(customers['Pays'])
+    return customers
+
+def write_variant_report(final_df, layout, sheet_name='Variants organisés', extra_sheets=None):
+    """Écrit le rapport Excel en une seule passe (mode constant_memory), formats appliqués à l'écriture"""
+    
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(sheet_name)
+    
+    header_format = workbook.add_format({
+        'bold': True,
+        'border': 1,
+        'align': 'center',
+        'valign': 'vcenter',
+        'text_wrap': True
+    })
+    
+    title_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#D3D3D3',
+        'align': 'center',
+        'font_size': 12
+    })
+    
+    # Format pour la ligne de total
+    total_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#E6E6E6',
+        'align': 'center',
+        'font_size': 11,
+        'border': 1
+    })
+    
+    row_formats = dict.fromkeys(layout['titles'], title_format)
+    row_formats[layout['total']] = total_format
+    if layout.get('parcel_total') is not None:
+        row_formats[layout['parcel_total']] = total_format
+    
+    # En-tête figé, largeurs de colonnes fixées avant l'écriture des lignes
+    worksheet.freeze_panes(1, 1)
+    variant_width = final_df['Variant'].str.len().max() if len(final_df) else 0
+    worksheet.set_column(0, 0, min(max(variant_width, len('Variant')) + 2, 100))
+    worksheet.set_column(1, layout['country_start'] - 1, 16)
+    for col_num, country in enumerate(final_df.columns[layout['country_start']:], start=layout['country_start']):
+        worksheet.set_column(col_num, col_num, max(len(country), 6) + 2)
+    
+    worksheet.write_row(0, 0, final_df.columns.tolist(), header_format)
+    
+    # Écriture ligne par ligne : en mode constant_memory chaque ligne est écrite une seule fois
+    for row_num, values in enumerate(final_df.to_numpy().tolist(), start=1):
+        row_format = row_formats.get(row_num - 1)
+        if row_format is not None:
+            worksheet.set_row(row_num, None, row_format)
+        worksheet.write_row(row_num, 0, values, row_format)
+    
+    # Feuilles complémentaires (clients par variant, produits associés...) : tableaux simples
+    for extra_name, extra_df in (extra_sheets or {}).items():
+        extra_sheet = workbook.add_worksheet(extra_name)
+        extra_sheet.freeze_panes(1, 0)
+        for col_num, col_name in enumerate(extra_df.columns):
+            values_width = extra_df[col_name].astype(str).str.len().max() if len(extra_df) else 0
+            extra_sheet.set_column(col_num, col_num, min(max(values_width, len(col_name)) + 2, 100))
+        extra_sheet.write_row(0, 0, extra_df.columns.tolist(), header_format)
+        for row_num, values in enumerate(extra_df.astype(object).where(extra_df.notna(), '').to_numpy().tolist(), start=1):
+            extra_sheet.write_row(row_num, 0, values)
+    
+    workbook.close()
+    buffer.seek(0)
+    return buffer
+
+def partition_customers_by_country(user_data):
+    """Répartit les clients par pays puis par variant (tri unique, sans boucle par client)"""
+    customers = pd.DataFrame({
+        'email': [data['email'] for data in user_data.values()],
+        'variant': [data['variant'] for data in user_data.values()],
+        'country': translate_countries(data['country'] for data in user_data.values())
+    })
+    customers['country'] = customers['country'].fillna('Inconnu')
+    
+    # Variants les plus fréquents en premier dans chaque pays
+    customers['packs'] = customers.groupby(['country', 'variant'])['email'].transform('size')
+    customers = customers.sort_values(['country', 'packs', 'variant', 'email'], ascending=[True, False, True, True])
+    return {country: frame for country, frame in customers.groupby('country', sort=True)}
+
+def write_pick_list(country, customers, variant_labels):
+    """Écrit la liste de préparation d'un pays : chaque variant avec son nombre de packs, puis ses clients"""
+    
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(country[:31])
+    
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    variant_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3'})
+    
+    worksheet.set_column(0, 0, 60)
+    worksheet.set_column(1, 1, 10)
+    worksheet.set_column(2, 2, 40)
+    worksheet.write_row(0, 0, ['Variant', 'Packs', 'Client'], header_format)
+    
+    row_num = 1
+    variants = customers['variant'].to_numpy()
+    emails = customers['email'].tolist()
+    starts = np.flatnonzero(np.r_[True, variants[1:] != variants[:-1]])
+    ends = np.r_[starts[1:], len(variants)]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        # Ligne du variant (avec son premier client), puis les autres clients en dessous
+        worksheet.write_string(row_num, 0, variant_labels[variants[start]], variant_format)
+        worksheet.write_number(row_num, 1, end - start, variant_format)
+        for email in emails[start:end]:
+            worksheet.write_string(row_num, 2, email)
+            row_num += 1
+    
+    workbook.close()
+    return buffer.getvalue()
+
+def build_pick_list_archive(user_data, variant_table):
+    """Génère une liste de préparation par pays (en parallèle) et les regroupe dans une archive ZIP"""
+    by_country = partition_customers_by_country(user_data)
+    variant_labels = {
+        variant_id: render_variant(variant_table, variant_id)
+        for variant_id in {data['variant'] for data in user_data.values()}
+    }
+    
+    # xlsxwriter travaille en mémoire : un classeur par pays, écrits par un pool de threads
+    with ThreadPoolExecutor(max_workers=min(len(by_country), 8) or 1) as executor:
+        workbooks = list(executor.map(
+            lambda item: (item[0], write_pick_list(item[0], item[1], variant_labels)),
+            by_country.items()
+        ))
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for country, workbook_bytes in workbooks:
+            file_name = re.sub(r'[^\w\-]+', '_', country).strip('_')
+            archive.writestr(f"preparation_{file_name}.xlsx", workbook_bytes)
+    buffer.seek(0)
+    return buffer, len(workbooks)
+
+@st.cache_resource
+def get_catalog_connection():
+    """Ouvre (et initialise si besoin) la base SQLite du catalogue produits"""
+    connection = sqlite3.connect(catalog_path, check_same_thread=False)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            product TEXT PRIMARY KEY,
+            weight REAL NOT NULL,
+            sku TEXT
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS bundles (
+            bundle TEXT NOT NULL,
+            component TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (bundle, component)
+        )
+    """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS shipping_rates (
+            zone TEXT NOT NULL,
+            max_weight REAL NOT NULL,
+            price REAL NOT NULL
+        )
+    """)
+    connection.commit()
+    return connection
+
+@st.cache_data
+def load_product_catalog():
+    """Charge le catalogue produits (mis en cache jusqu'à la prochaine modification)"""
+    return pd.read_sql_query(
+        "SELECT product AS 'Produit', weight AS 'Poids (kg)', sku AS 'SKU' FROM products ORDER BY product",
+        get_catalog_connection()
+    )
+
+def catalog_keys(products):
+    """Clé de catalogue des produits : nom sans espaces superflus (identique à l'enregistrement et à la recherche)"""
+    return products.astype(str).str.strip()
+
+def save_product_catalog(catalog_df):
+    """Enregistre (ou met à jour) des produits dans le catalogue"""
+    rows = catalog_df.dropna(subset=['Produit', 'Poids (kg)'])
+    sku = rows['SKU'] if 'SKU' in rows.columns else pd.Series(None, index=rows.index)
+    
+    connection = get_catalog_connection()
+    with connection:
+        connection.executemany(
+            """
+            INSERT INTO products (product, weight, sku) VALUES (?, ?, ?)
+            ON CONFLICT(product) DO UPDATE SET
+                weight = excluded.weight,
+                sku = COALESCE(excluded.sku, products.sku)
+            """,
+            zip(
+                catalog_keys(rows['Produit']).tolist(),
+                rows['Poids (kg)'].astype(float).tolist(),
+                sku.astype(object).where(sku.notna(), None).tolist()
+            )
+        )
+    
+    # Invalider le cache pour relire le catalogue à jour
+    load_product_catalog.clear()
+    return len(rows)
+
+def import_catalog_csv(csv_file):
+    """Importe en masse un catalogue CSV (colonnes Produit, Poids (kg), SKU optionnel)"""
+    catalog_df = pd.read_csv(csv_file)
+    
+    # Accepter aussi les en-têtes en anglais / minuscules
+    aliases = {
+        'produit': 'Produit', 'product': 'Produit',
+        'poids (kg)': 'Poids (kg)', 'poids': 'Poids (kg)', 'weight': 'Poids (kg)',
+        'sku': 'SKU'
+    }
+    catalog_df = catalog_df.rename(columns=lambda col: aliases.get(str(col).strip().lower(), col))
+    
+    if 'Produit' not in catalog_df.columns or 'Poids (kg)' not in catalog_df.columns:
+        raise ValueError("Le CSV doit contenir les colonnes 'Produit' et 'Poids (kg)'")
+    
+    catalog_df['Poids (kg)'] = pd.to_numeric(catalog_df['Poids (kg)'], errors='coerce')
+    return save_product_catalog(catalog_df)
+
+@st.cache_data
+def load_bundle_components():
+    """Charge la composition des packs (pack -> composant × quantité)"""
+    return pd.read_sql_query(
+        "SELECT bundle AS 'Pack', component AS 'Composant', quantity AS 'Quantité' FROM bundles ORDER BY bundle, component",
+        get_catalog_connection()
+    )
+
+def save_bundle_components(bundles):
+    """Remplace la composition des packs enregistrée"""
+    rows = bundles.dropna(subset=['Pack', 'Composant', 'Quantité'])
+    rows = rows.assign(
+        Pack=rows['Pack'].astype(str).str.strip(),
+        Composant=rows['Composant'].astype(str).str.strip()
+    ).drop_duplicates(subset=['Pack', 'Composant'], keep='last')
+    
+    connection = get_catalog_connection()
+    with connection:
+        connection.execute("DELETE FROM bundles")
+        connection.executemany(
+            "INSERT INTO bundles (bundle, component, quantity) VALUES (?, ?, ?)",
+            zip(
+                rows['Pack'].tolist(),
+                rows['Composant'].tolist(),
+                rows['Quantité'].astype(int).tolist()
+            )
+        )
+    
+    load_bundle_components.clear()
+    return len(rows)
+
+def bundle_line_mask(products, bundles):
+    """Lignes de pack, noms comparés comme au catalogue (espaces superflus ignorés)"""
+    return (products.notna() & catalog_keys(products).isin(catalog_keys(bundles['Pack']))).to_numpy()
+
+def explode_bundles(lines, bundles):
+    """Remplace chaque ligne de pack par ses composants (quantité × quantité du composant) en une seule jointure"""
+    is_pack = bundle_line_mask(lines['product'], bundles)
+    if not is_pack.any():
+        return lines
+    
+    components = pd.DataFrame({
+        'pack_key': catalog_keys(bundles['Pack']),
+        'component': bundles['Composant'],
+        'component_qty': bundles['Quantité']
+    })
+    
+    # Jointure à gauche sur le nom normalisé (texte des deux côtés, même si la colonne produit est vide ou numérique) :
+    # l'ordre des lignes est conservé, un pack donne une ligne par composant
+    pack_keys = catalog_keys(lines['product']).where(is_pack)
+    exploded = lines.assign(pack_key=pack_keys.to_numpy()).merge(components, on='pack_key', how='left')
+    is_bundle = exploded['component'].notna()
+    
+    if 'quantity' in exploded.columns:
+        quantities = pd.to_numeric(exploded['quantity'], errors='coerce').fillna(1)
+    else:
+        quantities = pd.Series(1, index=exploded.index)
+    exploded['quantity'] = quantities.where(~is_bundle, quantities * exploded['component_qty'])
+    exploded['product'] = exploded['component'].where(is_bundle, exploded['product'])
+    
+    return exploded.drop(columns=['pack_key', 'component', 'component_qty'])
+
+def read_export_header(file_name, file_bytes):
+    """Lit uniquement la ligne d'en-tête d'un export (CSV, XLSX, XLS ou Parquet)"""
+    extension = os.path.splitext(file_name)[1].lower()
+    
+    if extension == '.csv':
+        return pd.read_csv(io.BytesIO(file_bytes), nrows=0).columns.tolist()
+    if extension == '.parquet':
+        return pq.read_schema(io.BytesIO(file_bytes)).names
+    if extension == '.xlsx':
+        # Première feuille, comme pd.read_excel (et non la feuille active à l'enregistrement)
+        workbook = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True)
+        try:
+            header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return [f"Unnamed: {i}" if value is None else str(value) for i, value in enumerate(header)]
+    return pd.read_excel(io.BytesIO(file_bytes), nrows=0).columns.tolist()
+
+def iter_xlsx_records(file_bytes, header, usecols):
+    """Parcourt un XLSX en flux (read_only) : seules les cellules des colonnes utiles sont conservées"""
+    indices = [header.index(col_name) for col_name in usecols]
+    pick = itemgetter(*indices) if len(indices) > 1 else lambda row: (row[indices[0]],)
+    workbook = openpyxl.load_workbook(io.BytesIO(file_bytes), read_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(min_row=2, max_col=max(indices) + 1, values_only=True):
+            yield pick(row)
+    finally:
+        workbook.close()
+
+def read_order_export(file_name, file_bytes):
+    """Charge uniquement les colonnes détectées d'un export, sans lire les autres"""
+    header = read_export_header(file_name, file_bytes)
+    columns = detect_columns(pd.DataFrame(columns=header))
+    usecols = list(dict.fromkeys(columns.values()))
+    extension = os.path.splitext(file_name)[1].lower()
+    
+    if not usecols:
+        return pd.DataFrame(), columns
+    
+    # Colonnes de filtrage lues directement en catégories (peu de valeurs distinctes)
+    filter_columns = [columns[field] for field in ('status', 'line_type') if field in columns]
+    
+    if extension == '.csv':
+        # Pas de dtype pour le moteur pyarrow (il échoue sur une quantité vide) : conversion après lecture
+        df = pd.read_csv(io.BytesIO(file_bytes), usecols=usecols, engine='pyarrow')
+        df[filter_columns] = df[filter_columns].astype('category')
+    elif extension == '.parquet':
+        df = pd.read_parquet(io.BytesIO(file_bytes), columns=usecols, read_dictionary=filter_columns)
+    elif extension == '.xlsx':
+        df = pd.DataFrame.from_records(iter_xlsx_records(file_bytes, header, usecols), columns=usecols)
+    else:
+        df = pd.read_excel(io.BytesIO(file_bytes), usecols=usecols)
+    
+    return df, columns
+
+def load_order_file(file_name, file_bytes, backend='pandas'):
+    """Charge un export, filtre les lignes utiles et renomme les colonnes détectées en noms standard"""
+    df, columns = read_order_export(file_name, file_bytes)
+    summary = {'name': file_name, 'rows': len(df), 'columns': columns}
+    
+    if not has_required_columns(columns):
+        return summary, None
+    
+    extract_products, _ = PIPELINE_BACKENDS[backend]
+    _, df_filtered = extract_products(df, columns)
+    return summary, standardize_order_lines(df_filtered, columns)
+
+def standardize_order_lines(df, columns):
+    """Renomme les colonnes détectées en noms standard et normalise emails et numéros de commande"""
+    standardized = df[list(dict.fromkeys(columns.values()))].rename(
+        columns={col_name: field for field, col_name in columns.items()}
+    )
+    
+    # Emails comparables d'un export à l'autre ("Jean@Mail.com ", "jean+promo@mail.com") ; l'email saisi reste affiché
+    standardized['contact_email'] = contact_emails(standardized['email'])
+    standardized['email'] = normalize_emails(standardized['email'])
+    
+    # Numéros de commande comparables d'un export à l'autre ("#1001", 1001, "1001 ")
+    if 'order_id' in standardized.columns:
+        order_ids = standardized['order_id']
+        standardized['order_id'] = order_ids.astype(str).str.strip().str.lstrip('#').where(order_ids.notna())
+    
+    return standardized
+
+def merge_order_exports(frames):
+    """Fusionne les lignes de plusieurs exports ; une commande (email, n°) n'est gardée que depuis son premier export"""
+    merged = pd.concat(
+        [frame.assign(source_file=file_index) for file_index, frame in enumerate(frames)],
+        ignore_index=True
+    )
+    
+    duplicates = pd.Series(False, index=merged.index)
+    if 'order_id' in merged.columns:
+        identified = merged['email'].notna() & merged['order_id'].notna()
+        first_file = merged[identified].groupby(['email', 'order_id'])['source_file'].transform('min')
+        duplicates[identified] = merged.loc[identified, 'source_file'] != first_file
+    
+    return merged[~duplicates].drop(columns='source_file'), int(duplicates.sum())
+
+@st.cache_data(max_entries=8, ttl=3600, show_spinner=False)
+def analyze_order_exports(file_hashes, _files, link_by_address=False, bundles=None, backend='pandas'):
+    """Charge les exports en parallèle puis calcule les variants ; mis en cache par empreinte des fichiers"""
+    
+    # _files n'est pas haché par Streamlit : file_hashes (SHA-256 des contenus) sert de clé.
+    # bundles (composition des packs) fait partie de la clé : une nouvelle version relance la décomposition
+    with ThreadPoolExecutor(max_workers=min(len(_files), 4)) as executor:
+        loaded = list(executor.map(lambda uploaded: load_order_file(*uploaded, backend), _files))
+    
+    summaries = [summary for summary, _ in loaded]
+    frames = [frame for _, frame in loaded if frame is not None]
+    analysis = {'files': summaries, 'rows': sum(summary['rows'] for summary in summaries)}
+    
+    if not frames:
+        return analysis
+    
+    merged, duplicate_lines = merge_order_exports(frames)
+    
+    # Décomposer les packs en composants physiques avant de former les variants
+    bundle_lines = 0
+    if bundles is not None and not bundles.empty:
+        # Lignes de pack des clients identifiés (email renseigné), comptées comme en mode flux
+        bundle_lines = int((bundle_line_mask(merged['product'], bundles) & merged['email'].notna()).sum())
+        merged = explode_bundles(merged, bundles)
+    
+    columns = {field: field for field in merged.columns}
+    _, create_variants = PIPELINE_BACKENDS[backend]
+    user_data, variant_table = create_variants(merged, columns, link_by_address)
+    
+    analysis.update({
+        'columns': columns,
+        'duplicate_lines': duplicate_lines,
+        'bundle_lines': bundle_lines,
+        'linked_emails': int(merged.loc[merged['product'].notna(), 'email'].nunique()) - len(user_data),
+        # Produits des clients analysés (les deux modes listent les mêmes produits)
+        'unique_products': list(variant_table['products']),
+        'user_data': user_data,
+        'variant_table': variant_table,
+        'matrices': build_variant_matrices(user_data, variant_table)
+    })
+    
+    # Lignes datées conservées pour l'analyse par période (colonnes utiles uniquement)
+    if 'order_date' in merged.columns:
+        dated_columns = [field for field in ['order_date', 'email', 'product', 'quantity', 'country', 'shipping_name', 'zip'] if field in merged.columns]
+        analysis['dated_lines'] = merged[dated_columns]
+    return analysis
+
+# Périodes proposées pour l'analyse par cohorte (fréquences pandas)
+COHORT_PERIODS = {'Semaine': 'W', 'Mois': 'M'}
+
+def local_order_dates(values):
+    """Dates de commande à l'heure locale de chaque commande : le décalage horaire est ignoré, pas converti en UTC"""
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return values.dt.tz_localize(None)
+    if pd.api.types.is_datetime64_dtype(values):
+        return values
+    # "2024-03-01 00:30:00 +0100" -> "2024-03-01 00:30:00" (reste le 1er mars)
+    text = values.astype(str).str.strip().str.replace(r'\s*(?:Z|[+-]\d{2}:?\d{2})$', '', regex=True)
+    return pd.to_datetime(text.where(values.notna()), errors='coerce', format='mixed')
+
+def split_by_period(dated_lines, freq='W', link_by_address=False):
+    """Découpe les lignes datées par période : chaque client est rattaché à la période de sa première commande
+    (toutes ses lignes ensemble, pour que son variant soit complet) ; les clients sans date valide sont ignorés"""
+    dates = local_order_dates(dated_lines['order_date'])
+    
+    # Même identification des clients que pour le rapport (emails reliés par adresse si demandé)
+    address_keys = None
+    if link_by_address and 'shipping_name' in dated_lines.columns and 'zip' in dated_lines.columns:
+        address_keys = normalize_address_keys(dated_lines['shipping_name'], dated_lines['zip'])
+    customers = resolve_customers(dated_lines['email'], address_keys)
+    first_dates = dates.groupby(customers).transform('min')
+    
+    periods = first_dates.dt.to_period(freq)
+    kept = (periods.notna() & customers.notna()).to_numpy()
+    lines = dated_lines.drop(columns='order_date')[kept]
+    periods = periods[kept]
+    # Index remis à zéro : une période inchangée garde la même empreinte quand un export est ajouté
+    return {
+        str(period.start_time.date()): period_lines.reset_index(drop=True)
+        for period, period_lines in lines.groupby(periods, sort=True)
+    }
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def aggregate_period(period_lines, link_by_address=False):
+    """Clients par variant et par pays d'une période ; mis en cache par contenu, seule une période modifiée est recalculée"""
+    user_data, variant_table = create_variants_by_user(
+        period_lines, {field: field for field in period_lines.columns}, link_by_address
+    )
+    labels = [render_variant(variant_table, variant_id) for variant_id in range(len(variant_table['keys']))]
+    customers = pd.DataFrame({
+        'Variant': [labels[data['variant']] for data in user_data.values()],
+        'Pays': translate_countries(data['country'] for data in user_data.values())
+    })
+    customers['Pays'] = customers['Pays'].fillna('Inconnu')
+    return customers.value_counts().rename('Clients').reset_index()
+
+def build_cohort_report(period_counts, top_variants=8):
+    """Tableau de cohortes (clients par période et par pays) et part des principaux variants par période"""
+    counts = pd.concat(
+        [frame.assign(Période=period) for period, frame in period_counts.items()],
+        ignore_index=True
+    )
+    
+    cohort = counts.pivot_table(index='Période', columns='Pays', values='Clients', aggfunc='sum', fill_value=0)
+    countries = cohort.columns.tolist()
+    cohort.insert(0, 'Variants distincts', counts.groupby('Période')['Variant'].nunique())
+    cohort.insert(0, 'Clients', cohort[countries].sum(axis=1))
+    
+    # Part (%) des variants les plus fréquents sur toute la campagne, le reste regroupé
+    top = counts.groupby('Variant')['Clients'].sum().nlargest(top_variants).index
+    mix = counts.assign(Variant=counts['Variant'].where(counts['Variant'].isin(top), 'Autres combinaisons'))
+    mix = mix.pivot_table(index='Période', columns='Variant', values='Clients', aggfunc='sum', fill_value=0)
+    mix = (mix.div(mix.sum(axis=1), axis=0) * 100).round(1)
+    
+    cohort.columns.name = mix.columns.name = None
+    return cohort, mix
+
+def iter_order_chunks(file_name, file_bytes, chunksize=100_000):
+    """Colonnes détectées d'un export et itérateur de ses lignes par blocs (colonnes utiles uniquement)"""
+    header = read_export_header(file_name, file_bytes)
+    columns = detect_columns(pd.DataFrame(columns=header))
+    usecols = list(dict.fromkeys(columns.values()))
+    extension = os.path.splitext(file_name)[1].lower()
+    
+    def chunks():
+        if not usecols:
+            return
+        if extension == '.csv':
+            yield from pd.read_csv(io.BytesIO(file_bytes), usecols=usecols, chunksize=chunksize)
+        elif extension == '.parquet':
+            for batch in pq.ParquetFile(io.BytesIO(file_bytes)).iter_batches(batch_size=chunksize, columns=usecols):
+                yield batch.to_pandas()
+        elif extension == '.xlsx':
+            records = iter_xlsx_records(file_bytes, header, usecols)
+            while batch := list(islice(records, chunksize)):
+                yield pd.DataFrame.from_records(batch, columns=usecols)
+        else:
+            # Le format XLS ne se lit pas par blocs
+            yield pd.read_excel(io.BytesIO(file_bytes), usecols=usecols)
+    
+    return columns, chunks()
+
+def intern_values(values, codes):
+    """Codes entiers des valeurs (dictionnaire `codes` complété au fil des blocs), -1 si la valeur manque"""
+    for value in values.dropna().unique().tolist():
+        codes.setdefault(value, len(codes))
+    return values.map(codes).fillna(-1).astype(np.int64).to_numpy()
+
+# Clés des agrégats du mode flux : indicateurs du filtre (payé, ligne produit), fichier, doublon d'un export précédent
+STREAM_FLAGS = ['paid', 'line_item', 'file', 'duplicate']
+STREAM_STATES = {
+    'counts': ['customer', 'product'] + STREAM_FLAGS,
+    'firsts': ['customer'] + STREAM_FLAGS,
+    'orders': ['customer', 'order'] + STREAM_FLAGS
+}
+
+# Types compacts des colonnes de l'état (codes internés sur 32 bits)
+STREAM_DTYPES = {
+    'customer': np.int32, 'order': np.int32, 'product': np.int32, 'country': np.int32, 'contact': np.int32,
+    'paid': bool, 'line_item': bool, 'file': np.int16,
+    'qty': np.int32, 'lines': np.int32, 'pack_lines': np.int32, 'row': np.int64
+}
+
+def compact_stream_state(state):
+    """Fusionne les agrégats partiels des blocs (taille bornée par les clients et commandes, pas par les lignes)"""
+    # Un statut "paid" vu plus loin dans le fichier écarte définitivement les lignes non payées déjà agrégées
+    for name in STREAM_STATES:
+        state[name] = [frame[stream_filter_mask(state, frame, final=False)] for frame in state[name]]
+    
+    if len(state['counts']) > 1:
+        state['counts'] = [
+            pd.concat(state['counts'], ignore_index=True)
+            .groupby(STREAM_STATES['counts'], sort=False, as_index=False)
+            .agg({'qty': 'sum', 'lines': 'sum', 'pack_lines': 'sum'})
+        ]
+    for name in ('firsts', 'orders'):
+        if len(state[name]) > 1:
+            state[name] = [
+                pd.concat(state[name], ignore_index=True)
+                .sort_values('row', kind='stable')
+                .drop_duplicates(subset=STREAM_STATES[name])
+            ]
+
+def stream_filter_mask(state, frame, final=True):
+    """Masque des agrégats gardés par le filtre (même logique que combine_order_filters, fichier par fichier).
+    En cours de lecture (final=False), seules les lignes déjà certainement écartées sont retirées."""
+    file_flags = state['file_flags']
+    files = frame['file'].to_numpy(dtype=np.int64)
+    has_paid = np.array([flags['paid'] for flags in file_flags], dtype=bool)[files]
+    check_line = np.array([
+        flags['paid_line_item'] if flags['paid'] or final else False for flags in file_flags
+    ], dtype=bool)[files]
+    if final:
+        check_line |= np.array([flags['line_item'] and not flags['paid'] for flags in file_flags], dtype=bool)[files]
+    return (~has_paid | frame['paid'].to_numpy(dtype=bool)) & (~check_line | frame['line_item'].to_numpy(dtype=bool))
+
+def order_codes(frame):
+    """Code unique d'un couple (client, commande)"""
+    return (frame['customer'].to_numpy(dtype=np.int64) << 32) | frame['order'].to_numpy(dtype=np.int64)
+
+def close_stream_file(state, file_index):
+    """Fin d'un fichier : ses commandes gardées deviennent des doublons pour les exports suivants"""
+    compact_stream_state(state)
+    if state['orders']:
+        orders = state['orders'][0]
+        orders = orders[(orders['file'] == file_index) & ~orders['duplicate'].to_numpy(dtype=bool)]
+        orders = orders[stream_filter_mask(state, orders)]
+        state['seen_orders'] = np.union1d(state['seen_orders'], order_codes(orders))
+
+def add_stream_chunk(state, chunk, columns, file_index, bundles=None):
+    """Ajoute un bloc de lignes à l'état du mode flux (quantités par client et produit, premier pays, commandes)"""
+    row_offset = state['rows']
+    state['rows'] += len(chunk)
+    
+    # Indicateurs du filtre conservés par ligne : "si présent dans l'export" n'est connu qu'à la fin du fichier
+    no_flag = np.zeros(len(chunk), dtype=bool)
+    paid = lowered_value_mask(chunk[columns['status']], 'paid') if 'status' in columns else no_flag
+    line_item = lowered_value_mask(chunk[columns['line_type']], 'line item') if 'line_type' in columns else no_flag
+    flags = state['file_flags'][file_index]
+    flags['paid'] |= bool(paid.any())
+    flags['line_item'] |= bool(line_item.any())
+    flags['paid_line_item'] |= bool((paid & line_item).any())
+    
+    lines = standardize_order_lines(chunk, columns)
+    lines['paid'] = paid
+    lines['line_item'] = line_item
+    lines['row'] = np.arange(row_offset, row_offset + len(lines))
+    lines['first_component'] = True
+    lines['pack_line'] = False
+    
+    if bundles is not None and not bundles.empty:
+        lines['pack_line'] = bundle_line_mask(lines['product'], bundles)
+        lines = explode_bundles(lines, bundles)
+        lines['first_component'] = ~lines['row'].duplicated()
+        lines['pack_line'] &= lines['first_component']
+    
+    lines = lines[lines['email'].notna()]
+    if 'quantity' in lines.columns:
+        quantities = pd.to_numeric(lines['quantity'], errors='coerce').fillna(1).astype(int).to_numpy()
+    else:
+        quantities = 1
+    
+    coded = pd.DataFrame({
+        'customer': intern_values(lines['email'], state['emails']),
+        'order': intern_values(lines['order_id'], state['orders_codes']) if 'order_id' in lines.columns else -1,
+        'product': intern_values(lines['product'], state['products']),
+        'paid': lines['paid'].to_numpy(),
+        'line_item': lines['line_item'].to_numpy(),
+        'file': file_index,
+        'qty': quantities,
+        'lines': lines['first_component'].to_numpy(dtype=np.int64),
+        'pack_lines': lines['pack_line'].to_numpy(dtype=np.int64),
+        'row': lines['row'].to_numpy(),
+        'country': intern_values(lines['country'], state['countries']),
+        'contact': intern_values(lines['contact_email'], state['contacts'])
+    }).astype(STREAM_DTYPES)
+    
+    # Commande déjà gardée depuis un export précédent : ses lignes sont des doublons
+    coded['duplicate'] = (coded['order'].to_numpy() >= 0) & np.isin(order_codes(coded), state['seen_orders'])
+    coded = coded[stream_filter_mask(state, coded, final=False)]
+    
+    state['counts'].append(
+        coded.groupby(STREAM_STATES['counts'], sort=False, as_index=False)
+        .agg({'qty': 'sum', 'lines': 'sum', 'pack_lines': 'sum'})
+    )
+    state['firsts'].append(coded.drop_duplicates(subset=STREAM_STATES['firsts'])[STREAM_STATES['firsts'] + ['row', 'country', 'contact']])
+    state['orders'].append(
+        coded[coded['order'] >= 0].drop_duplicates(subset=STREAM_STATES['orders'])[STREAM_STATES['orders'] + ['row']]
+    )
+    
+    # Fusion régulière des agrégats pour garder une mémoire bornée
+    if len(state['counts']) >= 8:
+        compact_stream_state(state)
+
+def finalize_stream_state(state):
+    """Applique le filtre et le dédoublonnage sur l'état agrégé puis construit les variants"""
+    compact_stream_state(state)
+    
+    def kept(name):
+        frame = state[name][0] if state[name] else pd.DataFrame(
+            columns=STREAM_STATES[name] + ['qty', 'lines', 'pack_lines', 'row', 'country', 'contact'], dtype=np.int64
+        )
+        frame = frame[stream_filter_mask(state, frame)]
+        duplicates = frame['duplicate'].to_numpy(dtype=bool)
+        return frame[~duplicates], frame[duplicates]
+    
+    (counts, duplicate_counts), (firsts, _), (orders, _) = kept('counts'), kept('firsts'), kept('orders')
+    emails = np.array(list(state['emails']), dtype=object)
+    product_names = list(state['products'])
+    
+    # Quantités par client et produit, triées comme le moteur pandas (email puis rang du produit)
+    per_product = counts[counts['product'] >= 0].groupby(['customer', 'product'], as_index=False)['qty'].sum()
+    products = sorted({product_names[product_id] for product_id in per_product['product'].unique().tolist()})
+    ranks = {product: rank for rank, product in enumerate(products)}
+    per_product['email'] = emails[per_product['customer'].to_numpy(dtype=np.int64)]
+    per_product['rank'] = [ranks[product_names[product_id]] for product_id in per_product['product'].tolist()]
+    per_product = per_product.sort_values(['email', 'rank'])
+    
+    # Pays et email d'origine de la première ligne gardée de chaque client
+    country_names = np.array(list(state['countries']) + [np.nan], dtype=object)
+    contact_names = np.array(list(state['contacts']) + [np.nan], dtype=object)
+    first_rows = firsts.sort_values('row').drop_duplicates(subset='customer')
+    first_emails = emails[first_rows['customer'].to_numpy(dtype=np.int64)]
+    first_countries = pd.Series(country_names[first_rows['country'].to_numpy(dtype=np.int64)], index=first_emails)
+    first_contacts = pd.Series(contact_names[first_rows['contact'].to_numpy(dtype=np.int64)], index=first_emails)
+    
+    # Numéros de commande dans l'ordre d'apparition
+    order_names = np.array(list(state['orders_codes']), dtype=object)
+    orders = orders.sort_values('row').drop_duplicates(subset=['customer', 'order'])
+    orders_by_user = pd.Series(
+        order_names[orders['order'].to_numpy(dtype=np.int64)],
+        index=emails[orders['customer'].to_numpy(dtype=np.int64)],
+        dtype=object
+    ).groupby(level=0, sort=False).agg(list).to_dict()
+    
+    user_data, variant_table = assemble_user_variants(
+        per_product['email'].tolist(),
+        per_product['rank'].tolist(),
+        per_product['qty'].tolist(),
+        products,
+        first_countries,
+        orders_by_user,
+        first_contacts
+    )
+    
+    statistics = {
+        'duplicate_lines': int(duplicate_counts['lines'].sum()),
+        'bundle_lines': int(counts['pack_lines'].sum())
+    }
+    return user_data, variant_table, statistics
+
+@st.cache_data(max_entries=4, ttl=3600, show_spinner=False)
+def analyze_order_exports_streaming(file_hashes, _files, bundles=None, chunksize=100_000):
+    """Analyse par blocs : seuls les agrégats par client restent en mémoire, jamais l'export complet"""
+    state = {
+        'rows': 0, 'emails': {}, 'contacts': {}, 'orders_codes': {}, 'products': {}, 'countries': {},
+        'counts': [], 'firsts': [], 'orders': [], 'file_flags': [],
+        'seen_orders': np.array([], dtype=np.int64)
+    }
+    summaries = []
+    
+    for file_index, (file_name, file_bytes) in enumerate(_files):
+        columns, chunks = iter_order_chunks(file_name, file_bytes, chunksize)
+        state['file_flags'].append({'paid': False, 'line_item': False, 'paid_line_item': False})
+        rows_before = state['rows']
+        if has_required_columns(columns):
+            for chunk in chunks:
+                add_stream_chunk(state, chunk, columns, file_index, bundles)
+            close_stream_file(state, file_index)
+        summaries.append({'name': file_name, 'rows': state['rows'] - rows_before, 'columns': columns})
+    
+    analysis = {'files': summaries, 'rows': state['rows']}
+    if not any(has_required_columns(summary['columns']) for summary in summaries):
+        return analysis
+    
+    user_data, variant_table, statistics = finalize_stream_state(state)
+    analysis.update({
+        'columns': {field: field for summary in summaries for field in summary['columns']},
+        'duplicate_lines': statistics['duplicate_lines'],
+        'bundle_lines': statistics['bundle_lines'],
+        'linked_emails': 0,
+        'unique_products': list(variant_table['products']),
+        'user_data': user_data,
+        'variant_table': variant_table,
+        'matrices': build_variant_matrices(user_data, variant_table)
+    })
+    return analysis
+
+@st.cache_data
+def load_shipping_rates():
+    """Charge le barème d'expédition enregistré (barème par défaut s'il n'y en a pas)"""
+    rates = pd.read_sql_query(
+        "SELECT zone AS 'Zone', max_weight AS 'Poids max (kg)', price AS 'Prix (€)' FROM shipping_rates ORDER BY zone, max_weight",
+        get_catalog_connection()
+    )
+    return rates if not rates.empty else DEFAULT_SHIPPING_RATES.copy()
+
+def save_shipping_rates(rates):
+    """Remplace le barème d'expédition enregistré"""
+    rows = rates.dropna(subset=['Zone', 'Poids max (kg)', 'Prix (€)'])
+    
+    connection = get_catalog_connection()
+    with connection:
+        connection.execute("DELETE FROM shipping_rates")
+        connection.executemany(
+            "INSERT INTO shipping_rates (zone, max_weight, price) VALUES (?, ?, ?)",
+            zip(
+                rows['Zone'].astype(str).tolist(),
+                rows['Poids max (kg)'].astype(float).tolist(),
+                rows['Prix (€)'].astype(float).tolist()
+            )
+        )
+    
+    load_shipping_rates.clear()
+    return len(rows)
+
+# Nombre de produits affichés par page dans la table de configuration
+PRODUCTS_PER_PAGE = 25
+# Poids maximal saisissable pour un produit (les catalogues importés peuvent contenir des articles lourds)
+MAX_PRODUCT_WEIGHT = 1000.0
+
+def build_product_table(products, catalog_weights, ordered_products=()):
+    """Construit la table de configuration des produits : ordre de section, poids, présence au catalogue"""
+    ordered_products = list(ordered_products)
+    table = pd.DataFrame({'Produit': products})
+    table['Ordre'] = pd.array(
+        [ordered_products.index(product) + 1 if product in ordered_products else None for product in products],
+        dtype='Int64'
+    )
+    keys = catalog_keys(table['Produit'])
+    table['Poids (kg)'] = keys.map(catalog_weights).fillna(1.0).astype(float)
+    table['Au catalogue'] = keys.isin(list(catalog_weights))
+    return table
+
+def filter_product_table(product_table, search='', missing_only=False):
+    """Filtre la table des produits (recherche sur le nom, produits absents du catalogue)"""
+    mask = pd.Series(True, index=product_table.index)
+    if search:
+        mask &= product_table['Produit'].astype(str).str.contains(search, case=False, regex=False)
+    if missing_only:
+        mask &= ~product_table['Au catalogue']
+    return product_table[mask]
+
+def get_changed_weights(original_view, edited_view):
+    """Lignes dont le poids a réellement été modifié dans l'éditeur (le poids par défaut n'est pas enregistré)"""
+    before = original_view['Poids (kg)'].reindex(edited_view.index)
+    after = edited_view['Poids (kg)']
+    changed = after.notna() & ((after != before) | before.isna())
+    return edited_view[changed]
+
+def get_ordered_products(product_table):
+    """Produits principaux dans l'ordre des sections (colonne Ordre renseignée)"""
+    selected = product_table[product_table['Ordre'].notna()]
+    return selected.sort_values(['Ordre', 'Produit'])['Produit'].tolist()
 
 # Interface Streamlit
 st.title("🔍 Analyseur de Variants - Configuration Personnalisée")
 st.write("Analysez vos commandes et organisez les variants selon vos préférences.")
 
 # Étape 1: Upload
-uploaded_file = st.file_uploader("📁 Téléversez votre export Excel", type=['xlsx', 'xls'])
+uploaded_files = st.file_uploader(
+    "📁 Téléversez votre ou vos exports (Excel, CSV ou Parquet)",
+    type=['xlsx', 'xls', 'csv', 'parquet'],
+    accept_multiple_files=True,
+    help="Plusieurs exports d'une même campagne (précommandes, late pledges, boutiques...) sont fusionnés en un seul rapport"
+)
 
-if uploaded_file:
-    # Charger le fichier
-    with st.spinner("📊 Chargement du fichier..."):
-        df = pd.read_excel(uploaded_file)
-        st.success(f"✅ Fichier chargé ! {len(df)} lignes trouvées.")
+if uploaded_files:
+    # Charger et analyser les fichiers (résultat réutilisé tant que les contenus ne changent pas)
+    files = tuple((uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files)
+    file_hashes = tuple(hashlib.sha256(file_bytes).hexdigest() for _, file_bytes in files)
     
-    # Étape 2: Détection des colonnes
-    st.write("## 🔍 Détection des colonnes")
-    columns = detect_columns(df)
+    link_by_address = st.checkbox(
+        "🔗 Regrouper les emails d'un même client (même nom et code postal de livraison)",
+        value=False,
+        help="Les emails sont toujours normalisés (casse, espaces, alias +tag). Cette option relie en plus les commandes passées avec des emails différents mais livrées à la même personne."
+    )
     
-    if len(columns) >= 3:  # Au minimum email, pays, produit
-        st.success("✅ Colonnes détectées automatiquement")
-        for field, col_name in columns.items():
-            st.write(f"- **{field.title()}**: `{col_name}`")
-    else:
-        st.error("❌ Colonnes manquantes. Vérifiez votre fichier.")
-        st.stop()
+    # Composition des packs (optionnelle) : les packs sont remplacés par leurs composants
+    bundles = None
+    with st.expander("📦 Composition des packs"):
+        st.write("Un pack (ex: \"Pack Collector\") expédié en plusieurs articles : une ligne par composant.")
+        edited_bundles = st.data_editor(
+            load_bundle_components(),
+            num_rows="dynamic",
+            use_container_width=True,
+            column_config={
+                'Pack': st.column_config.TextColumn(required=True),
+                'Composant': st.column_config.TextColumn(required=True),
+                'Quantité': st.column_config.NumberColumn(min_value=1, step=1, required=True)
+            },
+            key="bundle_editor"
+        )
+        if st.button("💾 Enregistrer la composition des packs"):
+            saved = save_bundle_components(edited_bundles)
+            st.success(f"✅ Composition enregistrée ({saved} composants)")
     
-    # Étape 3: Extraction des produits
-    st.write("## 🎯 Produits détectés")
-    with st.spinner("🔄 Analyse des produits..."):
+    if st.checkbox("📦 Décomposer les packs en composants", value=False):
+        bundles = load_bundle_components()
+    
+    # Très gros exports : lecture par blocs, seuls les agrégats par client restent en mémoire
+    streaming = st.checkbox(
+        "💾 Mode gros fichiers (lecture par blocs)",
+        value=False,
+        help="Pour les exports de plusieurs centaines de Mo : la mémoire utilisée dépend du nombre de clients, pas du nombre de lignes."
+    )
+    
+    # Moteur de calcul : Polars si installé (utile pour les très gros exports), pandas sinon
+    backend = 'pandas'
+    if streaming:
+        if link_by_address:
+            st.warning("⚠️ Le regroupement par nom + code postal n'est pas disponible en mode gros fichiers.")
+    elif len(PIPELINE_BACKENDS) > 1:
+        backend = st.radio("⚙️ Moteur de calcul", list(PIPELINE_BACKENDS), horizontal=True,
+                           help="Polars répartit le filtrage et les regroupements sur tous les cœurs ; le résultat est identique.")
+    
+    with st.spinner("📊 Chargement et analyse des fichiers..."):
         try:
-            unique_products, df_filtered = extract_products_from_orders(df, columns)
-            user_data = create_variants_by_user(df_filtered, columns)
+            if streaming:
+                analysis = analyze_order_exports_streaming(file_hashes, files, bundles)
+            else:
+                analysis = analyze_order_exports(file_hashes, files, link_by_address, bundles, backend)
         except Exception as e:
             st.error(f"Erreur lors de l'analyse des produits: {str(e)}")
-            st.write(f"Colonnes détectées: {columns}")
-            st.write(f"Taille du DataFrame: {len(df)}")
-            st.write(f"Premières lignes du DataFrame:")
-            st.write(df.head())
+            for file_name, file_bytes in files:
+                st.write(f"**{file_name}**")
+                # Mode gros fichiers : en-tête seulement, sans recharger l'export complet en mémoire
+                if streaming:
+                    header = read_export_header(file_name, file_bytes)
+                    st.write(f"Colonnes détectées: {detect_columns(pd.DataFrame(columns=header))}")
+                    continue
+                df, detected_columns = read_order_export(file_name, file_bytes)
+                st.write(f"Colonnes détectées: {detected_columns}")
+                st.write(f"Taille du DataFrame: {len(df)}")
+                st.write(f"Premières lignes du DataFrame:")
+                st.write(df.head())
             st.stop()
     
+    st.success(f"✅ {len(files)} fichier(s) chargé(s) ! {analysis['rows']} lignes trouvées.")
+    
+    # Étape 2: Détection des colonnes (par fichier)
+    st.write("## 🔍 Détection des colonnes")
+    
+    for summary in analysis['files']:
+        if has_required_columns(summary['columns']):
+            st.success(f"✅ **{summary['name']}** ({summary['rows']} lignes) : colonnes détectées automatiquement")
+            for field, col_name in summary['columns'].items():
+                st.write(f"- **{field.title()}**: `{col_name}`")
+        else:
+            st.error(f"❌ **{summary['name']}** : colonnes manquantes, fichier ignoré. Vérifiez votre fichier.")
+    
+    if 'user_data' not in analysis:
+        st.stop()
+    
+    if analysis['duplicate_lines']:
+        st.info(f"ℹ️ {analysis['duplicate_lines']} lignes de commandes présentes dans plusieurs exports n'ont été comptées qu'une fois.")
+    
+    if analysis['bundle_lines']:
+        st.info(f"ℹ️ {analysis['bundle_lines']} lignes de packs décomposées en composants.")
+    
+    if analysis['linked_emails']:
+        st.info(f"ℹ️ {analysis['linked_emails']} emails rattachés à un autre email du même client (nom + code postal).")
+    
+    # Étape 3: Produits et variants
+    st.write("## 🎯 Produits détectés")
+    unique_products = analysis['unique_products']
+    user_data = analysis['user_data']
+    variant_table = analysis['variant_table']
+    matrices = analysis['matrices']
+    
     st.success(f"✅ {len(unique_products)} produits trouvés | {len(user_data)} utilisateurs analysés")
     
-    # Afficher les produits
-    col1, col2 = st.columns([2, 1])
+    # Évolution par période (si l'export contient la date de commande)
+    if 'dated_lines' in analysis:
+        with st.expander("📅 Évolution par période (cohortes)"):
+            period_name = st.radio("Période", list(COHORT_PERIODS), horizontal=True)
+            if st.checkbox("Afficher l'évolution des variants et des pays", value=False):
+                periods = split_by_period(analysis['dated_lines'], COHORT_PERIODS[period_name], link_by_address)
+                if periods:
+                    st.caption("Chaque client est compté une seule fois, dans la période de sa première commande, avec l'ensemble de ses commandes.")
+                    with st.spinner("📅 Agrégation par période..."):
+                        period_counts = {
+                            period: aggregate_period(period_lines, link_by_address)
+                            for period, period_lines in periods.items()
+                        }
+                    cohort, mix = build_cohort_report(period_counts)
+                    st.write("#### 👥 Clients par période et par pays")
+                    st.dataframe(cohort, use_container_width=True)
+                    st.write("#### 📈 Part des principaux variants (%)")
+                    st.line_chart(mix)
+                else:
+                    st.warning("⚠️ Aucune date de commande valide dans l'export.")
     
-    with col1:
-        st.write("**Produits disponibles :**")
-        for i, product in enumerate(unique_products, 1):
-            st.write(f"{i}. {product}")
+    # Catalogue persistant : poids connus pour pré-remplir la table des produits
+    catalog = load_product_catalog()
+    catalog_weights = dict(zip(catalog['Produit'], catalog['Poids (kg)']))
+    
+    # Une table de configuration par jeu de fichiers et de produits (packs décomposés ou non), conservée entre les reruns
+    table_key = f"product_table_{hashlib.sha256('|'.join(file_hashes + tuple(unique_products)).encode()).hexdigest()}"
+    if table_key not in st.session_state:
+        st.session_state[table_key] = build_product_table(
+            unique_products, catalog_weights, st.session_state.get('selected_products', [])
+        )
+    product_table = st.session_state[table_key]
+    
+    # Étape 4: Configuration des produits (sections principales et poids)
+    st.write("## ⚙️ Configuration des produits")
+    
+    st.info("""
+    **Instructions :**
+    
+    Renseignez un numéro dans la colonne **Ordre** pour les produits que vous voulez comme "sections principales" (1 = première section), et vérifiez leur **poids**. Les poids des produits déjà au catalogue sont pré-remplis.
+    """)
     
+    known_products = int(product_table['Au catalogue'].sum())
+    with st.expander(f"📚 Catalogue des poids ({known_products}/{len(unique_products)} produits connus)"):
+        col1, col2 = st.columns(2)
+        with col1:
+            catalog_file = st.file_uploader("Importer un catalogue (CSV)", type=['csv'], key="catalog_import")
+            if catalog_file and st.button("📥 Importer le catalogue"):
+                try:
+                    imported = import_catalog_csv(catalog_file)
+                    catalog = load_product_catalog()
+                    # Oublier les tables et grilles pré-remplies avec l'ancien catalogue
+                    ordered_products = get_ordered_products(product_table)
+                    for key in [key for key in st.session_state if key.startswith(('product_table_', 'product_grid_'))]:
+                        del st.session_state[key]
+                    # Recharger les poids importés en gardant l'ordre des sections choisi
+                    product_table = build_product_table(
+                        unique_products,
+                        dict(zip(catalog['Produit'], catalog['Poids (kg)'])),
+                        ordered_products
+                    )
+                    st.session_state[table_key] = product_table
+                    st.success(f"✅ {imported} produits importés dans le catalogue")
+                except Exception as e:
+                    st.error(f"Erreur lors de l'import du catalogue: {str(e)}")
+        with col2:
+            st.download_button(
+                label="📤 Exporter le catalogue (CSV)",
+                data=catalog.to_csv(index=False),
+                file_name="catalogue_produits.csv",
+                mime="text/csv"
+            )
+    
+    # Recherche et pagination : un seul tableau éditable, quel que soit le nombre de produits
+    col1, col2, col3 = st.columns([3, 2, 1])
+    with col1:
+        search = st.text_input("🔎 Rechercher un produit", key="product_search")
     with col2:
-        st.info("""
-        **Instructions :**
+        missing_only = st.checkbox("Seulement les produits absents du catalogue", value=False)
+    
+    product_view = filter_product_table(product_table, search, missing_only)
+    page_count = max(1, -(-len(product_view) // PRODUCTS_PER_PAGE))
+    with col3:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1,
+                               key=f"product_page_{search}_{missing_only}")
+    page_view = product_view.iloc[(page - 1) * PRODUCTS_PER_PAGE:page * PRODUCTS_PER_PAGE]
+    st.caption(f"{len(product_view)} produit(s) | page {page}/{page_count}")
+    
+    # Utiliser un formulaire pour éviter les rechargements constants
+    with st.form("product_configuration"):
+        edited_view = st.data_editor(
+            page_view,
+            hide_index=True,
+            use_container_width=True,
+            disabled=['Produit', 'Au catalogue'],
+            column_config={
+                'Ordre': st.column_config.NumberColumn(
+                    "Ordre", min_value=1, step=1,
+                    help="Ordre de la section dans le rapport (vide = pas une section principale)"
+                ),
+                'Poids (kg)': st.column_config.NumberColumn(
+                    "Poids (kg)", min_value=0.0, max_value=MAX_PRODUCT_WEIGHT, step=0.1, format="%.3f"
+                ),
+                'Au catalogue': st.column_config.CheckboxColumn("Au catalogue")
+            },
+            key=f"product_grid_{search}_{missing_only}_{page}"
+        )
+        configuration_submitted = st.form_submit_button("✅ Valider la configuration", type="secondary")
+    
+    if configuration_submitted:
+        # Reporter les modifications de la page dans la table complète
+        product_table.loc[edited_view.index, ['Ordre', 'Poids (kg)']] = edited_view[['Ordre', 'Poids (kg)']]
         
-        Sélectionnez les produits que vous voulez comme "sections principales" et définissez leur ordre d'affichage.
-        """)
-    
-    # Étape 4: Configuration utilisateur AVANT les poids
-    st.write("## ⚙️ Sélection des produits principaux")
-    
-    # Utiliser session_state pour éviter les rechargements
-    if 'selected_products' not in st.session_state:
-        st.session_state.selected_products = []
-    
-    selected_products = st.multiselect(
-        "Choisissez les produits principaux (dans l'ordre d'affichage souhaité) :",
-        options=unique_products,
-        default=st.session_state.selected_products,
-        help="L'ordre de sélection = ordre des sections dans le rapport final",
-        key="product_selector"
-    )
+        # Enregistrer dans le catalogue les seuls poids saisis ou modifiés
+        changed = get_changed_weights(page_view, edited_view)
+        if not changed.empty:
+            save_product_catalog(changed)
+            product_table.loc[changed.index, 'Au catalogue'] = True
+        st.success("✅ Configuration sauvegardée !")
     
     # Sauvegarder la sélection
+    selected_products = get_ordered_products(product_table)
     st.session_state.selected_products = selected_products
+    product_weights = dict(zip(product_table['Produit'], product_table['Poids (kg)']))
     
     if selected_products:
-        # Étape 5: Configuration des poids (optimisée)
-        st.write("## ⚖️ Configuration des poids des produits")
+        st.write("### 📋 Aperçu de l'organisation")
+        for i, product in enumerate(selected_products, 1):
+            st.write(f"**{i}. {product}** ({product_weights[product]:.3f}kg) → Tous les variants contenant ce produit")
         
-        st.write("Renseignez le poids de chaque produit pour calculer automatiquement le poids des variants :")
+        if len(selected_products) < len(unique_products):
+            st.write(f"**{len(selected_products) + 1}. Autres combinaisons** → Variants restants")
         
-        # Utiliser un formulaire pour éviter les rechargements constants
-        with st.form("weight_configuration"):
-            st.write("**Configurez les poids :**")
-            
-            product_weights = {}
-            
-            # Interface pour saisir les poids (seulement pour les produits sélectionnés)
-            cols = st.columns(2)
-            
-            for i, product in enumerate(unique_products):
-                col_index = i % 2
-                with cols[col_index]:
-                    # Utiliser session_state pour les valeurs par défaut
-                    default_weight = st.session_state.get(f'weight_{product}', 1.0)
-                    
-                    weight = st.number_input(
-                        f"Poids de **{product}** (kg)",
-                        min_value=0.0,
-                        max_value=50.0,
-                        value=default_weight,
-                        step=0.1,
-                        format="%.3f",
-                        key=f"form_weight_{i}"
-                    )
-                    product_weights[product] = weight
-            
-            # Bouton pour valider les poids
-            weights_submitted = st.form_submit_button("✅ Valider les poids", type="secondary")
-            
-            if weights_submitted:
-                # Sauvegarder les poids dans session_state
-                for product, weight in product_weights.items():
-                    st.session_state[f'weight_{product}'] = weight
-                st.success("✅ Poids sauvegardés !")
+        # Poids issus de la table de configuration
+        final_product_weights = product_weights
         
-        # Afficher l'aperçu seulement si les poids ont été validés
-        if any(f'weight_{product}' in st.session_state for product in selected_products):
-            st.write("### 📋 Aperçu de l'organisation")
-            for i, product in enumerate(selected_products, 1):
-                weight = st.session_state.get(f'weight_{product}', 1.0)
-                st.write(f"**{i}. {product}** ({weight:.3f}kg) → Tous les variants contenant ce produit")
-            
-            if len(selected_products) < len(unique_products):
-                st.write(f"**{len(selected_products) + 1}. Autres combinaisons** → Variants restants")
-            
-            # Récupérer les poids depuis session_state
-            final_product_weights = {}
-            for product in unique_products:
-                final_product_weights[product] = st.session_state.get(f'weight_{product}', 1.0)
-            
-            # Étape 6: Génération
-            if st.button("🚀 Générer le rapport personnalisé", type="primary"):
-                with st.spinner("🔄 Génération en cours..."):
-                    
-                    # Organiser selon la configuration
-                    sections = organize_by_user_order(user_data, selected_products)
-                    
-                    # Créer le DataFrame final avec les poids configurés
-                    final_df = create_final_dataframe(sections, user_data, final_product_weights)
-                
-                # Statistiques
-                st.write("## 📈 Résultats")
+        # Frais de port (optionnel)
+        shipping_rates = None
+        if st.checkbox("🚚 Estimer les frais de port par variant", value=False):
+            st.write("Barème d'expédition (tranche de poids × zone). Zones : France, Outre-mer, Europe, Monde.")
+            shipping_rates = st.data_editor(
+                load_shipping_rates(),
+                num_rows="dynamic",
+                use_container_width=True,
+                column_config={
+                    'Zone': st.column_config.SelectboxColumn(options=['France', 'Outre-mer', 'Europe', 'Monde'], required=True),
+                    'Poids max (kg)': st.column_config.NumberColumn(min_value=0.0, format="%.3f", required=True),
+                    'Prix (€)': st.column_config.NumberColumn(min_value=0.0, format="%.2f", required=True)
+                },
+                key="shipping_rates_editor"
+            )
+            if st.button("💾 Enregistrer le barème"):
+                saved = save_shipping_rates(shipping_rates)
+                st.success(f"✅ Barème enregistré ({saved} tranches)")
+        
+        # Plan de colis (optionnel) : découpage des packs trop lourds selon les limites du transporteur
+        parcel_limits = None
+        if st.checkbox("📦 Planifier les colis (packs trop lourds répartis en plusieurs colis)", value=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                max_weight = st.number_input("Poids max par colis (kg)", min_value=0.1, value=30.0, step=0.5)
+            with col2:
+                max_items = st.number_input("Articles max par colis (0 = sans limite)", min_value=0, value=0, step=1)
+            parcel_limits = {'max_weight': max_weight, 'max_items': int(max_items) or None}
+        
+        # Étape 6: Génération
+        with_customer_sheet = st.checkbox("👥 Ajouter la feuille des clients par variant", value=False)
+        with_pick_lists = st.checkbox("📦 Générer aussi les listes de préparation par pays (ZIP)", value=False)
+        
+        # Toute modification des paramètres (poids, barème, ordre des sections...) invalide le rapport conservé
+        report_key = hash_report_inputs(
+            table_key, link_by_address, bundles, streaming, backend, selected_products, final_product_weights,
+            shipping_rates, parcel_limits, with_customer_sheet, with_pick_lists
+        )
+        
+        if st.button("🚀 Générer le rapport personnalisé", type="primary"):
+            with st.spinner("🔄 Génération en cours..."):
                 
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Utilisateurs", len(user_data))
-                with col2:
-                    st.metric("Sections créées", len(sections))
-                with col3:
-                    st.metric("Variants uniques", len(set(data['variant'] for data in user_data.values())))
+                # Organiser selon la configuration
+                sections = organize_by_user_order(user_data, selected_products, variant_table)
                 
-                # Aperçu
-                st.write("### 👀 Aperçu du tableau")
-                st.dataframe(final_df.head(20), use_container_width=True)
+                # Créer le DataFrame final avec les poids configurés
+                final_df, layout = create_final_dataframe(
+                    sections, variant_table, matrices, final_product_weights, shipping_rates, parcel_limits
+                )
                 
-                # Export
-                st.write("### 💾 Téléchargement")
+                # Produits commandés ensemble (onglet et feuille dédiés)
+                cooccurrence = calculate_product_cooccurrence(matrices, variant_table)
+                extra_sheets = {'Produits associés': cooccurrence['top'], 'Paires de produits': cooccurrence['pairs']}
                 
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    final_df.to_excel(writer, sheet_name='Variants organisés', index=False)
-                    
-                    # Formatage des titres
-                    workbook = writer.book
-                    worksheet = writer.sheets['Variants organisés']
-                    
-                    title_format = workbook.add_format({
-                        'bold': True,
-                        'bg_color': '#D3D3D3',
-                        'align': 'center',
-                        'font_size': 12
-                    })
-                    
-                    # Format pour la ligne de total
-                    total_format = workbook.add_format({
-                        'bold': True,
-                        'bg_color': '#E6E6E6',
-                        'align': 'center',
-                        'font_size': 11,
-                        'border': 1
-                    })
-                    
-                    for row_num, (_, row) in enumerate(final_df.iterrows(), start=1):
-                        if isinstance(row['Variant'], str):
-                            if row['Variant'].startswith('---'):
-                                worksheet.set_row(row_num, None, title_format)
-                            elif row['Variant'] == 'TOTAL PACKS':
-                                worksheet.set_row(row_num, None, total_format)
+                # Colis par variant et par pays (plan de colis demandé)
+                parcels = None
+                if parcel_limits is not None:
+                    parcels = create_parcel_dataframe(final_df, layout)
+                    extra_sheets['Colis par pays'] = parcels
                 
-                buffer.seek(0)
+                # Clients de chaque variant, dans l'ordre du rapport
+                if with_customer_sheet:
+                    report_rows = sorted(layout['variant_rows'])
+                    extra_sheets['Clients par variant'] = build_customer_index(
+                        [layout['variant_rows'][row] for row in report_rows],
+                        variant_table,
+                        user_data,
+                        final_df['Variant'].iloc[report_rows].tolist()
+                    )
                 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"variants_personnalises_{timestamp}.xlsx"
+                pick_lists = None
+                if with_pick_lists:
+                    pick_lists = build_pick_list_archive(user_data, variant_table)
+            
+            # Conserver le rapport : cliquer sur une ligne relance la page
+            st.session_state.variant_report = {
+                'key': report_key,
+                'sections': sections,
+                'final_df': final_df,
+                'layout': layout,
+                'cooccurrence': cooccurrence,
+                'parcels': parcels,
+                'workbook': write_variant_report(final_df, layout, extra_sheets=extra_sheets).getvalue(),
+                'pick_lists': pick_lists,
+                'timestamp': timestamp
+            }
+        
+        report = st.session_state.get('variant_report')
+        if report is not None and report['key'] != report_key:
+            st.info("ℹ️ La configuration a changé depuis la dernière génération : relancez la génération pour mettre à jour le rapport.")
+            report = None
+        if report is not None:
+            final_df = report['final_df']
+            layout = report['layout']
+            
+            # Statistiques
+            st.write("## 📈 Résultats")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Utilisateurs", len(user_data))
+            with col2:
+                st.metric("Sections créées", len(report['sections']))
+            with col3:
+                st.metric("Variants uniques", len(variant_table['keys']))
+            
+            if 'Frais de port (€)' in final_df.columns:
+                shipping_column = final_df['Frais de port (€)']
+                st.metric("🚚 Frais de port estimés (campagne)", f"{shipping_column.iloc[layout['total']]:.2f} €")
+                over_limit = int((shipping_column == 'Hors barème').sum())
+                no_rates = int((shipping_column == 'Zone sans tarif').sum())
+                if no_rates:
+                    st.warning(f"⚠️ {no_rates} variant(s) sont livrés dans une zone sans tarif dans le barème ; ils ne sont pas chiffrés ni comptés dans le total.")
+                if over_limit:
+                    st.warning(f"⚠️ {over_limit} variant(s) dépassent la dernière tranche du barème ; ils ne sont pas chiffrés ni comptés dans le total.")
+            
+            if 'Colis' in final_df.columns:
+                st.metric("📦 Colis à expédier", final_df['Colis'].iloc[layout['total']])
+                oversize = int((final_df['Hors limite'] == '⚠️').sum())
+                if oversize:
+                    st.warning(f"⚠️ {oversize} variant(s) contiennent un article plus lourd que la limite par colis (colonne « Hors limite »).")
+                with st.expander("📦 Colis par variant et par pays"):
+                    st.dataframe(report['parcels'], hide_index=True, use_container_width=True)
+            
+            report_tab, cooccurrence_tab = st.tabs(["📋 Rapport", "🔗 Produits associés"])
+            
+            with report_tab:
+                # Aperçu, avec les clients de la ligne sélectionnée
+                st.write("### 👀 Aperçu du tableau")
+                st.caption("Cliquez sur une ligne de variant pour afficher ses clients.")
+                selection = st.dataframe(
+                    final_df,
+                    use_container_width=True,
+                    on_select="rerun",
+                    selection_mode="single-row",
+                    key="report_table"
+                )
                 
+                selected_rows = [row for row in selection.selection.rows if row in layout['variant_rows']]
+                if selected_rows:
+                    row = selected_rows[0]
+                    customers = build_customer_index(
+                        [layout['variant_rows'][row]], variant_table, user_data, [final_df['Variant'].iloc[row]]
+                    )
+                    st.write(f"#### 👥 {final_df['Variant'].iloc[row]} — {len(customers)} client(s)")
+                    st.dataframe(customers.drop(columns='Variant'), hide_index=True, use_container_width=True)
+            
+            with cooccurrence_tab:
+                cooccurrence = report['cooccurrence']
+                st.write("Produits les plus souvent commandés ensemble (lift > 1 : plus souvent qu'un simple hasard).")
+                st.write("#### 🏷️ Associations par produit")
+                st.dataframe(cooccurrence['top'], hide_index=True, use_container_width=True)
+                st.write("#### 🔗 Paires les plus fréquentes")
+                st.dataframe(cooccurrence['pairs'].head(100), hide_index=True, use_container_width=True)
+            
+            # Export
+            st.write("### 💾 Téléchargement")
+            
+            st.download_button(
+                label="📥 Télécharger le rapport Excel",
+                data=report['workbook'],
+                file_name=f"variants_personnalises_{report['timestamp']}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+            
+            if report['pick_lists'] is not None:
+                archive, country_count = report['pick_lists']
                 st.download_button(
-                    label="📥 Télécharger le rapport Excel",
-                    data=buffer,
-                    file_name=filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    label=f"📦 Télécharger les listes de préparation ({country_count} pays)",
+                    data=archive.getvalue(),
+                    file_name=f"listes_preparation_{report['timestamp']}.zip",
+                    mime="application/zip"
                 )
-                
-                st.success("✅ Rapport généré avec votre configuration personnalisée !")
-    
+            
+            st.success("✅ Rapport généré avec votre configuration personnalisée !")
+
     else:
         st.warning("⚠️ Sélectionnez au moins un produit pour continuer.")
 
 else:
-    st.info("👆 Commencez par téléverser votre fichier Excel d'export.")
+    st.info("👆 Commencez par téléverser votre ou vos fichiers Excel d'export.")
     
     with st.expander("ℹ️ Format de fichier attendu"):
         st.write("""
@@ -632,9 +2126,14 @@ else:
         - Quantité (ex: "Line: Quantity", "quantity")
         - Statut de paiement (ex: "Payment: Status", "status")
         - Type de ligne (ex: "Line: Type", "type")
+        - Numéro de commande (ex: "Name", "order_id") pour fusionner plusieurs exports sans doublons
+        - Nom et code postal de livraison (ex: "Shipping: Name", "Shipping: Zip") pour regrouper les emails d'un même client
+        - Date de commande (ex: "Created at") pour suivre l'évolution des variants par semaine ou par mois
+        
+        **Packs :** la composition des packs (pack → composants × quantité) est enregistrée dans le catalogue ; une fois décomposés, les variants et les poids portent sur les articles réellement expédiés.
         
         **Logique :**
-        1. Regroupe les commandes par utilisateur (email)
+        1. Regroupe les commandes par utilisateur (email normalisé, ou nom + code postal si demandé)
         2. Crée des "variants" = combinaisons de produits achetés
         3. Organise selon votre ordre de priorité
         4. Évite les doublons automatiquement
@@ -0,0 +1,54 @@
+import ast
+import os
+import types
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+PAGES_DIR = Path(__file__).resolve().parent.parent / "pages"
+
+
+def load_page_definitions(file_name):
+    """Charge les fonctions et constantes d'une page Streamlit, sans exécuter l'interface (tout ce qui suit st.title)"""
+    path = PAGES_DIR / file_name
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    body = []
+    for node in tree.body:
+        call = node.value if isinstance(node, ast.Expr) else None
+        if isinstance(call, ast.Call) and ast.unparse(call.func) == "st.title":
+            break
+        body.append(node)
+    module = types.ModuleType(path.stem)
+    module.__file__ = str(path)
+    exec(compile(ast.Module(body, []), str(path), "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture
+def variant_page(tmp_path, monkeypatch):
+    monkeypatch.setenv("PRODUCT_CATALOG_PATH", str(tmp_path / "catalog.sqlite"))
+    # Les caches Streamlit survivent d'un test à l'autre (connexion SQLite, catalogue)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    return load_page_definitions("variant_analysis.py")
+
+
+@pytest.fixture
+def abo_page(monkeypatch):
+    monkeypatch.setenv("MONGODB_URI", os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    return load_page_definitions("ABO_JVM_Csv_to_Excel.py")
+
+
+@pytest.fixture
+def build_report(variant_page):
+    """Construit le rapport final (DataFrame, layout) à partir de lignes email / pays / produit / quantité"""
+    def build(lines, ordered_products, product_weights, **options):
+        lines = pd.DataFrame(lines, columns=['email', 'country', 'product_name', 'quantity'])
+        columns = variant_page.detect_columns(lines)
+        user_data, variant_table = variant_page.create_variants_by_user(lines, columns)
+        matrices = variant_page.build_variant_matrices(user_data, variant_table)
+        sections = variant_page.organize_by_user_order(user_data, ordered_products, variant_table)
+        return variant_page.create_final_dataframe(sections, variant_table, matrices, product_weights, **options)
+    return build
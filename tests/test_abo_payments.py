@@ -0,0 +1,72 @@
+import io
+
+import pandas as pd
+
+
+def order_export(text, name="orders.csv"):
+    buffer = io.BytesIO(text.encode("utf-8"))
+    buffer.name = name
+    return buffer
+
+
+ORDERS = (
+    "Subscription ID,Financial Status,Total\n"
+    "111,paid,10.00\n"
+    "222,paid,29.98\n"
+    "222,,\n"
+    "222,paid,14.98\n"
+)
+
+
+def test_blank_status_chunk_keeps_whole_file(abo_page):
+    subscribers = pd.Series(["111", "222"])
+    for chunksize in (1, 2, 100):
+        payments = abo_page.aggregate_order_payments([order_export(ORDERS)], subscribers, chunksize=chunksize)
+        assert payments.loc["222", "Payé (€)"] == 44.96
+        assert payments.loc["222", "Commandes"] == 2
+        assert payments.loc["111", "Payé (€)"] == 10.0
+
+
+def test_unreadable_file_is_dropped_entirely(abo_page):
+    broken = order_export(ORDERS + '222,paid,"5.00\n', name="broken.csv")
+    payments = abo_page.aggregate_order_payments(
+        [order_export(ORDERS), broken], pd.Series(["111", "222"]), chunksize=1
+    )
+    # Aucune somme partielle du fichier en erreur n'est conservée
+    assert payments.loc["222", "Payé (€)"] == 44.96
+    assert payments.loc["111", "Commandes"] == 1
+
+
+RENEWALS = (
+    "Subscription ID,Financial Status,Total,Created at\n"
+    "333,paid,54.96,2023-04-01 09:00:00 +0200\n"
+    "333,paid,54.96,2024-04-01 09:00:00 +0200\n"
+    "333,paid,54.96,2025-03-31 23:30:00 +0200\n"
+    "444,paid,54.96,2025-01-10 10:00:00 +0100\n"
+)
+
+
+def test_renewed_subscriber_is_reconciled_on_current_cycle(abo_page):
+    debt_df = pd.DataFrame({
+        'ID': ['333', '444'],
+        'Customer name': ['Jean Dupont', 'Marie Curie'],
+        'Zone': ['France', 'France'],
+        'Next order date': pd.to_datetime(['2026-04-01 07:00:00', None]),
+        'Created at': pd.to_datetime(['2023-04-01 07:00:00', '2025-01-10 09:00:00']),
+        'Magazines envoyés': [6, 9],
+        'Magazines Restants': [6, 3],
+        'Prix par magazine': [54.96 / 12, 54.96 / 12],
+    })
+    cycle_starts = abo_page.current_cycle_starts(debt_df)
+    assert cycle_starts['333'] == pd.Timestamp('2025-04-01 07:00:00')
+
+    payments = abo_page.aggregate_order_payments(
+        [order_export(RENEWALS)], abo_page.normalize_ids(debt_df['ID']), chunksize=2, cycle_starts=cycle_starts
+    )
+    # Seul le renouvellement du cycle en cours est compté (pas les 3 années d'abonnement)
+    assert payments.loc['333', 'Payé (€)'] == 54.96
+    assert payments.loc['333', 'Commandes'] == 1
+
+    reconciliation = abo_page.reconcile_debt(debt_df, payments).set_index('ID')
+    assert reconciliation.loc['333', 'Dette réelle (€)'] == 27.48
+    assert reconciliation['Statut'].tolist() == ['OK', 'OK']
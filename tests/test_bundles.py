@@ -0,0 +1,30 @@
+import hashlib
+
+import pandas as pd
+
+BUNDLES = pd.DataFrame({'Pack': ['Pack Collector'] * 2, 'Composant': ['Tome 1', 'Poster A3'], 'Quantité': [1, 2]})
+
+
+def analyze_both(variant_page, csv_text, bundles):
+    files = (('orders.csv', csv_text.encode('utf-8')),)
+    file_hashes = (hashlib.sha256(files[0][1]).hexdigest(),)
+    return (
+        variant_page.analyze_order_exports(file_hashes, files, False, bundles),
+        variant_page.analyze_order_exports_streaming(file_hashes, files, bundles, chunksize=2),
+    )
+
+
+def test_blank_product_column_does_not_break_bundle_explosion(variant_page):
+    lines = pd.DataFrame({'email': ['a@x.fr', 'b@x.fr'], 'product': [float('nan')] * 2, 'quantity': [1.0, 2.0]})
+    assert variant_page.explode_bundles(lines, BUNDLES).equals(lines)
+
+    csv_text = "email,country,product_name,quantity\na@x.fr,France,,1\nb@x.fr,France,,2\nc@x.fr,France,Tome 1,1\n"
+    for analysis in analyze_both(variant_page, csv_text, BUNDLES):
+        assert analysis['user_data']['c@x.fr']['products'] == {'Tome 1': 1}
+
+
+def test_pack_name_with_trailing_space_is_exploded(variant_page):
+    csv_text = 'email,country,product_name,quantity\na@x.fr,France,"Pack Collector ",2\nb@x.fr,France,Tome 1,1\n'
+    for analysis in analyze_both(variant_page, csv_text, BUNDLES):
+        assert analysis['user_data']['a@x.fr']['products'] == {'Poster A3': 4, 'Tome 1': 2}
+        assert analysis['bundle_lines'] == 1
@@ -0,0 +1,28 @@
+import pandas as pd
+
+
+def dated(rows):
+    return pd.DataFrame(rows, columns=['order_date', 'email', 'product', 'quantity', 'country'])
+
+
+def test_periods_use_local_order_time(variant_page):
+    lines = dated([
+        ('2024-03-01 00:30:00 +0100', 'a@x.fr', 'Tome 1', 1, 'France'),
+        ('2024-03-04T00:15:00+01:00', 'b@x.fr', 'Tome 1', 1, 'France'),
+    ])
+    assert list(variant_page.split_by_period(lines, 'M')) == ['2024-03-01']
+    # Lundi 4 mars 00:15 : semaine du 4 mars, pas la précédente
+    assert list(variant_page.split_by_period(lines, 'W')) == ['2024-02-26', '2024-03-04']
+
+
+def test_customer_counted_once_in_first_order_period(variant_page):
+    lines = dated([
+        ('2024-01-15 10:00:00 +0100', 'a@x.fr', 'Tome 1', 1, 'France'),
+        ('2024-02-20 10:00:00 +0100', 'a@x.fr', 'Tome 2', 1, 'France'),
+        ('2024-02-21 10:00:00 +0100', 'b@x.fr', 'Tome 2', 1, 'Belgium'),
+    ])
+    periods = variant_page.split_by_period(lines, 'M')
+    counts = {period: variant_page.aggregate_period(period_lines) for period, period_lines in periods.items()}
+
+    assert counts['2024-01-01'].to_dict('records') == [{'Variant': '1× Tome 1 + 1× Tome 2', 'Pays': 'France', 'Clients': 1}]
+    assert counts['2024-02-01'].to_dict('records') == [{'Variant': '1× Tome 2', 'Pays': 'Belgique', 'Clients': 1}]
@@ -0,0 +1,30 @@
+import pandas as pd
+
+
+def test_pair_count_and_lift(variant_page):
+    lines = pd.DataFrame(
+        [
+            ('a@x.fr', 'France', 'Tome 1', 1),
+            ('a@x.fr', 'France', 'Tome 2', 1),
+            ('b@x.fr', 'France', 'Tome 1', 2),
+            ('b@x.fr', 'France', 'Tome 2', 1),
+            ('c@x.fr', 'France', 'Tome 1', 1),
+            ('d@x.fr', 'France', 'Poster', 1),
+        ],
+        columns=['email', 'country', 'product_name', 'quantity']
+    )
+    user_data, variant_table = variant_page.create_variants_by_user(lines, variant_page.detect_columns(lines))
+    matrices = variant_page.build_variant_matrices(user_data, variant_table)
+
+    cooccurrence = variant_page.calculate_product_cooccurrence(matrices, variant_table, top_k=5)
+
+    # 2 clients sur 4 prennent Tome 1 et Tome 2 ; Tome 1 : 3 clients, Tome 2 : 2 -> lift = 2 × 4 / (3 × 2)
+    pairs = cooccurrence['pairs']
+    assert pairs[['Produit A', 'Produit B']].to_numpy().tolist() == [['Tome 1', 'Tome 2']]
+    assert pairs['Clients (ensemble)'].tolist() == [2]
+    assert pairs['Lift'].tolist() == [1.33]
+
+    top = cooccurrence['top'].set_index('Produit')
+    assert top.loc['Tome 2', 'Produit associé'] == 'Tome 1'
+    assert top.loc['Tome 2', '% des clients du produit'] == 100.0
+    assert top.loc['Tome 1', '% des clients du produit'] == 66.7
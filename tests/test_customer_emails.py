@@ -0,0 +1,44 @@
+import hashlib
+
+CSV_TEXT = (
+    "email,country,product_name,quantity,shipping_name,zip\n"
+    "Jean.Dupont+promo@Mail.fr ,France,Tome 1,1,Jean Dupont,75001\n"
+    "jean.dupont@mail.fr,France,Tome 2,1,Jean Dupont,75001\n"
+    "jd@travail.fr,France,Tome 2,1,jean  dupont,75 001\n"
+    "b@x.fr,Belgium,Tome 1,2,Anne Martin,1000\n"
+)
+
+
+def analyze(variant_page, link_by_address):
+    files = (('orders.csv', CSV_TEXT.encode('utf-8')),)
+    file_hashes = (hashlib.sha256(files[0][1]).hexdigest(),)
+    return variant_page.analyze_order_exports(file_hashes, files, link_by_address)
+
+
+def test_emails_sharing_name_and_zip_are_one_customer(variant_page):
+    analysis = analyze(variant_page, link_by_address=True)
+
+    assert list(analysis['user_data']) == ['b@x.fr', 'jd@travail.fr']
+    assert analysis['user_data']['jd@travail.fr']['products'] == {'Tome 1': 1, 'Tome 2': 2}
+    assert analysis['linked_emails'] == 1
+
+
+def test_original_email_is_displayed_and_exported(variant_page):
+    analysis = analyze(variant_page, link_by_address=True)
+    user_data, variant_table = analysis['user_data'], analysis['variant_table']
+
+    # Identifiant résolu pour le regroupement, premier email saisi pour l'affichage
+    assert user_data['jd@travail.fr']['email'] == 'Jean.Dupont+promo@Mail.fr'
+    customers = variant_page.build_customer_index(range(len(variant_table['keys'])), variant_table, user_data)
+    assert sorted(customers['Email']) == ['Jean.Dupont+promo@Mail.fr', 'b@x.fr']
+    by_country = variant_page.partition_customers_by_country(user_data)
+    assert by_country['France']['email'].tolist() == ['Jean.Dupont+promo@Mail.fr']
+
+
+def test_streaming_keeps_first_original_email(variant_page):
+    files = (('orders.csv', CSV_TEXT.encode('utf-8')),)
+    file_hashes = (hashlib.sha256(files[0][1]).hexdigest(),)
+    streaming = variant_page.analyze_order_exports_streaming(file_hashes, files, chunksize=1)
+
+    assert streaming['user_data']['jean.dupont@mail.fr']['email'] == 'Jean.Dupont+promo@Mail.fr'
+    assert streaming['user_data'] == analyze(variant_page, link_by_address=False)['user_data']
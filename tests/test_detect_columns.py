@@ -0,0 +1,39 @@
+import pandas as pd
+
+
+def headers(*names):
+    return pd.DataFrame(columns=list(names))
+
+
+def test_shopify_name_is_the_order_number(variant_page):
+    columns = variant_page.detect_columns(headers('Name', 'Customer: Email', 'Shipping: Country', 'Line: Name'))
+    assert columns['order_id'] == 'Name'
+
+
+def test_name_outside_shopify_is_not_an_order_number(variant_page):
+    columns = variant_page.detect_columns(headers('name', 'email', 'country', 'product_name'))
+    assert 'order_id' not in columns
+
+
+def test_explicit_order_id_is_preferred(variant_page):
+    columns = variant_page.detect_columns(headers('Name', 'Order ID', 'Line: Name'))
+    assert columns['order_id'] == 'Order ID'
+
+
+def test_name_is_not_an_order_number_across_merged_exports(variant_page):
+    lines = pd.DataFrame({'name': ['Jean Dupont'], 'email': ['a@b.fr'], 'country': ['France'], 'product_name': ['Tome 1']})
+    columns = variant_page.detect_columns(lines)
+    frames = [variant_page.standardize_order_lines(lines, columns) for _ in range(2)]
+    merged, duplicates = variant_page.merge_order_exports(frames)
+    assert duplicates == 0 and len(merged) == 2
+
+
+def test_specific_order_date_is_preferred(variant_page):
+    columns = variant_page.detect_columns(headers('Date', 'Email', 'Created At', 'Fulfillment Date'))
+    assert columns['order_date'] == 'Created At'
+
+
+def test_bare_date_is_used_only_when_unambiguous(variant_page):
+    assert variant_page.detect_columns(headers('email', 'date', 'product_name'))['order_date'] == 'date'
+    assert 'order_date' not in variant_page.detect_columns(headers('email', 'date', 'birth date', 'product_name'))
+    assert 'order_date' not in variant_page.detect_columns(headers('email', 'export date', 'product_name'))
@@ -0,0 +1,42 @@
+import openpyxl
+
+
+def test_parcels_per_variant_and_country(variant_page, build_report):
+    final_df, layout = build_report(
+        [
+            ('a@x.fr', 'France', 'Plateau', 1),
+            ('a@x.fr', 'France', 'Tome', 2),
+            ('b@x.fr', 'Japan', 'Plateau', 1),
+            ('b@x.fr', 'Japan', 'Tome', 2),
+            ('c@x.fr', 'France', 'Plateau', 1),
+            ('c@x.fr', 'France', 'Tome', 2),
+            ('d@x.fr', 'France', 'Tome', 1),
+            ('e@x.fr', 'Japan', 'Statue', 1),
+        ],
+        ['Plateau', 'Tome', 'Statue'], {'Plateau': 20.0, 'Tome': 8.0, 'Statue': 40.0},
+        parcel_limits={'max_weight': 25.0, 'max_items': None}
+    )
+    rows = sorted(layout['variant_rows'])
+    # 20 + 8 + 8 kg : deux colis ; 8 kg : un colis ; 40 kg : un colis hors limite
+    assert final_df['Colis par pack'].iloc[rows].tolist() == [2, 1, 1]
+    assert all(isinstance(count, int) for count in final_df['Colis par pack'].iloc[rows])
+    assert final_df['Hors limite'].iloc[rows].tolist() == ['', '', '⚠️']
+
+    parcels = variant_page.create_parcel_dataframe(final_df, layout)
+    assert parcels[['France', 'Japan']].to_numpy().tolist() == [[4, 2], [1, 0], [0, 1], [5, 3]]
+    assert parcels['Colis'].tolist() == [6, 1, 1, 8]
+    assert parcels['Variant'].iloc[-1] == 'TOTAL COLIS'
+
+
+def test_parcel_counts_are_numeric_in_workbook(variant_page, build_report):
+    final_df, layout = build_report(
+        [('a@x.fr', 'France', 'Statue', 1), ('b@x.fr', 'France', 'Tome', 1)],
+        ['Statue', 'Tome'], {'Statue': 40.0, 'Tome': 1.0},
+        parcel_limits={'max_weight': 25.0, 'max_items': None}
+    )
+    workbook = openpyxl.load_workbook(variant_page.write_variant_report(final_df, layout))
+    sheet = workbook.worksheets[0]
+    header = [cell.value for cell in sheet[1]]
+    column = header.index('Colis par pack')
+    values = [sheet.cell(row=row + 2, column=column + 1).value for row in sorted(layout['variant_rows'])]
+    assert values == [1, 1]
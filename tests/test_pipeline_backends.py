@@ -0,0 +1,100 @@
+import hashlib
+import io
+import random
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+pytest.importorskip("polars")
+
+HEADER = ['Name', 'Customer: Email', 'Shipping: Country', 'Shipping: Name', 'Shipping: Zip',
+          'Line: Name', 'Line: Quantity', 'Payment: Status', 'Line: Type']
+
+
+def order_rows(seed=0, orders=300):
+    rng = random.Random(seed)
+    rows = []
+    for number in range(1, orders + 1):
+        customer = rng.randrange(120)
+        email = rng.choice([f"client{customer}@mail.fr", f" Client{customer}@Mail.fr", None])
+        country = rng.choice(['France', 'Belgium', 'Japan', 'Canada', None])
+        status = rng.choice(['paid', 'Paid', 'pending'])
+        for _ in range(rng.randint(1, 3)):
+            rows.append([
+                f"#{number}", email, country, f"Client {customer}", f"750{customer % 10}",
+                rng.choice(['Tome 1', 'Tome 2', 'Tome 3', 'Coffret', None]),
+                rng.choice([1, 2, 3, None]), status, rng.choice(['Line Item', 'Line Item', 'Shipping Line'])
+            ])
+    return pd.DataFrame(rows, columns=HEADER)
+
+
+def csv_bytes(frame):
+    return frame.to_csv(index=False).encode('utf-8')
+
+
+def parquet_bytes(frame):
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def mixed_xlsx_bytes(frame):
+    # Quantités en texte une ligne sur trois, numéros de commande tantôt texte, tantôt nombre, un pays numérique
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(HEADER)
+    for position, row in enumerate(frame.itertuples(index=False)):
+        row = [None if isinstance(value, float) and np.isnan(value) else value for value in row]
+        if position % 3 == 0 and row[6] is not None:
+            row[6] = str(int(row[6]))
+        if position % 2 == 0:
+            row[0] = int(row[0].lstrip('#'))
+        if position == 5:
+            row[2] = 33
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def analyze(variant_page, files, backend, link_by_address=False):
+    file_hashes = tuple(hashlib.sha256(file_bytes).hexdigest() for _, file_bytes in files)
+    return variant_page.analyze_order_exports(file_hashes, files, link_by_address, backend=backend)
+
+
+def comparable(analysis):
+    variant_table = analysis['variant_table']
+    return {
+        'user_data': analysis['user_data'],
+        'keys': variant_table['keys'],
+        'products': variant_table['products'],
+        'customers_by_variant': variant_table['customers_by_variant'],
+        'counts': analysis['matrices']['counts'].tolist(),
+        'unique_products': analysis['unique_products'],
+        'linked_emails': analysis['linked_emails'],
+    }
+
+
+@pytest.mark.parametrize("file_name, writer", [
+    ('orders.csv', csv_bytes),
+    ('orders.xlsx', mixed_xlsx_bytes),
+    ('orders.parquet', parquet_bytes),
+])
+@pytest.mark.parametrize("link_by_address", [False, True])
+def test_polars_backend_matches_pandas(variant_page, file_name, writer, link_by_address):
+    files = ((file_name, writer(order_rows())),)
+    pandas_result = analyze(variant_page, files, 'pandas', link_by_address)
+    polars_result = analyze(variant_page, files, 'polars', link_by_address)
+    assert comparable(polars_result) == comparable(pandas_result)
+
+
+def test_polars_backend_matches_pandas_across_formats(variant_page):
+    frame = order_rows(seed=1)
+    files = (
+        ('first.csv', csv_bytes(frame.iloc[:200])),
+        ('second.xlsx', mixed_xlsx_bytes(frame.iloc[150:500])),
+        ('third.parquet', parquet_bytes(frame.iloc[450:])),
+    )
+    assert comparable(analyze(variant_page, files, 'polars')) == comparable(analyze(variant_page, files, 'pandas'))
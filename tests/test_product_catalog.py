@@ -0,0 +1,39 @@
+import io
+
+import pandas as pd
+
+
+def test_catalog_lookup_ignores_surrounding_whitespace(variant_page):
+    variant_page.save_product_catalog(pd.DataFrame({'Produit': ['  Tome 1 '], 'Poids (kg)': [0.4]}))
+    catalog = variant_page.load_product_catalog()
+    weights = dict(zip(catalog['Produit'], catalog['Poids (kg)']))
+
+    table = variant_page.build_product_table(['Tome 1 ', 'Tome 1', 'Tome 2'], weights)
+    assert table['Poids (kg)'].tolist() == [0.4, 0.4, 1.0]
+    assert table['Au catalogue'].tolist() == [True, True, False]
+
+
+def test_imported_heavy_weights_are_kept(variant_page):
+    csv_file = io.BytesIO("product,weight\nPlateau de jeu,72.5\n".encode("utf-8"))
+    assert variant_page.import_catalog_csv(csv_file) == 1
+    catalog = variant_page.load_product_catalog()
+    table = variant_page.build_product_table(
+        ['Plateau de jeu'], dict(zip(catalog['Produit'], catalog['Poids (kg)']))
+    )
+    assert table.loc[0, 'Poids (kg)'] == 72.5
+    assert table.loc[0, 'Poids (kg)'] <= variant_page.MAX_PRODUCT_WEIGHT
+
+
+def test_only_edited_weights_are_saved(variant_page):
+    table = variant_page.build_product_table(['Tome 1', 'Tome 2', 'Tome 3'], {'Tome 1': 0.4})
+    edited = table.copy()
+    edited.loc[1, 'Poids (kg)'] = 0.35
+    edited.loc[2, 'Ordre'] = 1
+
+    changed = variant_page.get_changed_weights(table, edited)
+    assert changed['Produit'].tolist() == ['Tome 2']
+
+    variant_page.save_product_catalog(changed)
+    catalog = variant_page.load_product_catalog()
+    # Tome 3 garde son poids par défaut et reste hors catalogue
+    assert catalog['Produit'].tolist() == ['Tome 2']
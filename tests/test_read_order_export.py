@@ -0,0 +1,44 @@
+import io
+
+import openpyxl
+import pandas as pd
+
+
+def workbook_bytes(active_index):
+    workbook = openpyxl.Workbook()
+    orders = workbook.active
+    orders.title = 'Commandes'
+    orders.append(['Email', 'Country', 'Product_Name', 'Quantity'])
+    orders.append(['a@x.fr', 'France', 'Tome 1', 2])
+    notes = workbook.create_sheet('Notes')
+    notes.append(['Remarque'])
+    notes.append(['à relire'])
+    workbook.active = active_index
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_xlsx_streaming_reads_first_sheet_like_pandas(variant_page):
+    file_bytes = workbook_bytes(active_index=1)
+    df, columns = variant_page.read_order_export('orders.xlsx', file_bytes)
+    expected = pd.read_excel(io.BytesIO(file_bytes))
+    assert variant_page.has_required_columns(columns)
+    assert df.to_dict('list') == expected.to_dict('list')
+
+
+def test_csv_with_blank_quantity(variant_page):
+    file_bytes = (
+        "Email,Country,Line: Name,Line: Quantity,Payment: Status,Line: Type\n"
+        "a@x.fr,France,Tome 1,,paid,Line Item\n"
+        "b@x.fr,France,Tome 2,2,paid,Line Item\n"
+    ).encode("utf-8")
+    df, columns = variant_page.read_order_export('orders.csv', file_bytes)
+    assert df['Payment: Status'].dtype == 'category'
+    assert df['Line: Type'].dtype == 'category'
+
+    _, df_filtered = variant_page.extract_products_from_orders(df, columns)
+    user_data, variant_table = variant_page.create_variants_by_user(df_filtered, columns)
+    # Quantité vide : 1 article
+    assert user_data['a@x.fr']['products'] == {'Tome 1': 1}
+    assert user_data['b@x.fr']['products'] == {'Tome 2': 2}
@@ -0,0 +1,12 @@
+import pandas as pd
+
+
+def test_report_key_changes_with_any_input(variant_page):
+    rates = pd.DataFrame({'Zone': ['France'], 'Poids max (kg)': [1.0], 'Prix (€)': [5.0]})
+    base = ('table', ['Tome 1'], {'Tome 1': 0.4}, rates, None)
+    key = variant_page.hash_report_inputs(*base)
+
+    assert variant_page.hash_report_inputs(*base) == key
+    assert variant_page.hash_report_inputs('table', ['Tome 1'], {'Tome 1': 0.5}, rates, None) != key
+    assert variant_page.hash_report_inputs('table', ['Tome 1'], {'Tome 1': 0.4}, rates.assign(**{'Prix (€)': 6.0}), None) != key
+    assert variant_page.hash_report_inputs('table', ['Tome 1'], {'Tome 1': 0.4}, rates, {'max_weight': 30.0}) != key
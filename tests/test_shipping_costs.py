@@ -0,0 +1,32 @@
+import pandas as pd
+
+RATES = pd.DataFrame({
+    'Zone': ['France', 'France', 'Europe'],
+    'Poids max (kg)': [1.0, 2.0, 1.0],
+    'Prix (€)': [5.0, 8.0, 10.0]
+})
+
+
+def test_zone_without_rates_is_not_reported_as_over_limit(build_report):
+    final_df, layout = build_report(
+        [
+            ('a@x.fr', 'France', 'Tome', 1),
+            ('b@x.fr', 'Japan', 'Tome', 1),
+            ('c@x.fr', 'France', 'Tome', 2),
+            ('d@x.fr', 'France', 'Tome', 3),
+        ],
+        ['Tome'], {'Tome': 0.8}, shipping_rates=RATES
+    )
+    costs = final_df.loc[list(layout['variant_rows']), 'Frais de port (€)'].tolist()
+    # 1 tome : France chiffrée, Japon (zone Monde) sans tarif -> variant partiel exclu du total
+    # 2 tomes : 1,6 kg chiffré ; 3 tomes : 2,4 kg au-delà de la dernière tranche
+    assert costs == ['Zone sans tarif', 8.0, 'Hors barème']
+    assert final_df['Frais de port (€)'].iloc[layout['total']] == 8.0
+
+
+def test_fully_priced_variants_are_summed(build_report):
+    final_df, layout = build_report(
+        [('a@x.fr', 'France', 'Tome', 1), ('b@x.fr', 'Germany', 'Tome', 1)],
+        ['Tome'], {'Tome': 0.5}, shipping_rates=RATES
+    )
+    assert final_df['Frais de port (€)'].iloc[layout['total']] == 15.0
@@ -0,0 +1,71 @@
+import hashlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+BUNDLES = pd.DataFrame({'Pack': ['Pack Collector'] * 2, 'Composant': ['Tome 1', 'Poster A3'], 'Quantité': [1, 2]})
+
+
+def order_lines(rows, customers, seed):
+    rng = np.random.default_rng(seed)
+    lines = pd.DataFrame({
+        'Name': [f"#{number}" for number in rng.integers(1000, 1000 + customers * 2, rows)],
+        'Customer: Email': [f"client{number}@mail.fr" for number in rng.integers(0, customers, rows)],
+        'Shipping: Country': rng.choice(['France', 'Belgium', 'Japan', 'Canada'], rows),
+        'Line: Name': rng.choice(['Tome 1', 'Tome 2', 'Pack Collector', 'Poster A3'], rows),
+        'Line: Quantity': rng.integers(1, 4, rows).astype(float),
+        'Payment: Status': rng.choice(['paid', 'Paid', 'pending'], rows, p=[.6, .3, .1]),
+        'Line: Type': rng.choice(['Line Item', 'Shipping Line'], rows, p=[.85, .15]),
+    })
+    lines.loc[lines.index[::25], 'Line: Quantity'] = np.nan
+    lines.loc[lines.index[::40], 'Customer: Email'] = np.nan
+    return lines
+
+
+def export_bytes(frame, extension):
+    buffer = io.BytesIO()
+    if extension == 'csv':
+        frame.to_csv(buffer, index=False)
+    elif extension == 'parquet':
+        frame.to_parquet(buffer, index=False)
+    else:
+        frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("extension", ['csv', 'parquet', 'xlsx'])
+@pytest.mark.parametrize("bundles", [None, BUNDLES], ids=['sans packs', 'packs'])
+def test_streaming_matches_in_memory(variant_page, extension, bundles):
+    first = order_lines(1500, 400, seed=1)
+    # Second export : reprend une partie des commandes du premier (doublons entre exports)
+    second = pd.concat([order_lines(1000, 400, seed=2), first.iloc[:300]], ignore_index=True)
+    files = tuple((f"{name}.{extension}", export_bytes(frame, extension)) for name, frame in [('a', first), ('b', second)])
+    file_hashes = tuple(hashlib.sha256(file_bytes).hexdigest() for _, file_bytes in files)
+
+    in_memory = variant_page.analyze_order_exports(file_hashes, files, False, bundles)
+    streaming = variant_page.analyze_order_exports_streaming(file_hashes, files, bundles, chunksize=397)
+
+    assert list(streaming['user_data']) == list(in_memory['user_data'])
+    for email, data in in_memory['user_data'].items():
+        assert streaming['user_data'][email]['products'] == data['products']
+        assert list(map(str, streaming['user_data'][email]['orders'])) == list(map(str, data['orders']))
+    assert streaming['variant_table']['keys'] == in_memory['variant_table']['keys']
+    assert streaming['unique_products'] == in_memory['unique_products']
+    assert (streaming['matrices']['counts'] == in_memory['matrices']['counts']).all()
+    assert streaming['duplicate_lines'] == in_memory['duplicate_lines'] > 0
+    assert streaming['bundle_lines'] == in_memory['bundle_lines']
+    if bundles is not None:
+        assert in_memory['bundle_lines'] > 0
+
+
+def test_unique_products_only_come_from_analysed_customers(variant_page):
+    csv_text = "email,country,product_name,quantity\na@x.fr,France,Tome 2,1\n,France,Goodies,1\nb@x.fr,France,Tome 1,1\n"
+    files = (('orders.csv', csv_text.encode('utf-8')),)
+    file_hashes = (hashlib.sha256(files[0][1]).hexdigest(),)
+
+    in_memory = variant_page.analyze_order_exports(file_hashes, files)
+    streaming = variant_page.analyze_order_exports_streaming(file_hashes, files, chunksize=2)
+
+    assert in_memory['unique_products'] == streaming['unique_products'] == ['Tome 1', 'Tome 2']
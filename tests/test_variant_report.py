@@ -0,0 +1,24 @@
+LINES = [
+    ('a@x.fr', 'France', 'Tome 1', 1),
+    ('a@x.fr', 'France', 'Tome 2', 1),
+    ('b@x.fr', 'Belgium', 'Tome 1', 1),
+    ('b@x.fr', 'Belgium', 'Tome 2', 1),
+    ('c@x.fr', 'France', 'Tome 1', 2),
+    ('d@x.fr', 'France', 'Poster', 1),
+]
+
+
+def test_sections_and_total_packs(build_report):
+    final_df, layout = build_report(LINES, ['Tome 1', 'Tome 2', 'Poster'], {'Tome 1': 0.5, 'Tome 2': 0.5, 'Poster': 0.2})
+
+    # Une section par premier produit commandé, variants les plus fréquents en premier
+    assert final_df['Variant'].tolist() == [
+        '--- TOME 1 ---', '1× Tome 1 + 1× Tome 2', '2× Tome 1', '',
+        '--- POSTER ---', '1× Poster', '',
+        'TOTAL PACKS'
+    ]
+    assert layout['titles'] == [0, 4] and layout['total'] == 7
+    assert final_df['Poids des packs'].iloc[[1, 2, 5]].tolist() == ['1.000kg', '1.000kg', '0.200kg']
+    assert final_df.loc[[1, 2, 5, 7], 'Nombre de packs'].tolist() == [2, 1, 1, 4]
+    assert final_df.loc[[1, 2, 5, 7], "Packs en livraison à l'étranger"].tolist() == [1, 0, 0, 1]
+    assert final_df.loc[7, ['Belgique', 'France']].tolist() == [1, 3]